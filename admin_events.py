@@ -0,0 +1,110 @@
+import json
+import time
+import asyncio
+from datetime import datetime
+from telegram_output import get_outbox
+from settings import get_settings
+
+FLUSH_INTERVAL = 60  # Seconds between admin digests
+FLUSH_SIZE = 50  # Events that trigger a digest before the interval is over
+EVENT_LOG = 'admin_events.log'
+
+EVENT_DESCRIPTIONS = {
+    'start': "started the bot.",
+    'show_necessity': "watching the necessity of safety check.",
+    'set_wallet': "clicked set_wallet button.",
+    'change_wallet': "clicked update_wallet button.",
+    'check_valid': "watching valid transactions.",
+    'check_invalid': "watching invalid transactions.",
+    'payment_help': "watching payment help.",
+    'safety_checked': "checked safety of his wallet.",
+    'wallet_registered': "registered new wallet address.",
+    'payment_verified': "registered verified payment transaction.",
+}
+
+_event_bus = None
+
+
+class AdminEventBus:
+    """Collects user events for the admin and delivers them as periodic digests.
+
+    Publishing never waits on Telegram: events are buffered in memory, then a background task
+    appends them to an append-only JSON-lines log and sends one digest message to the admin
+    every FLUSH_INTERVAL seconds or FLUSH_SIZE events, whichever comes first.
+    """
+
+    def __init__(self, admin_chat_id, log_path=EVENT_LOG, interval=FLUSH_INTERVAL, max_events=FLUSH_SIZE):
+        self.admin_chat_id = admin_chat_id
+        self.log_path = log_path
+        self.interval = interval
+        self.max_events = max_events
+        self.pending = []
+        self.flush_requested = asyncio.Event()
+        self.task = None
+
+    def publish(self, event, user_id, **fields):
+        """Record an event; returns immediately."""
+        self.pending.append({'time': time.time(), 'event': event, 'user_id': user_id, **fields})
+        if len(self.pending) >= self.max_events:
+            self.flush_requested.set()
+
+    def start(self, bot):
+        """Start the background task that flushes digests."""
+        self.task = asyncio.create_task(self._run(bot))
+
+    async def stop(self, bot):
+        """Stop the background task and flush whatever is still buffered."""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush(bot)
+
+    async def _run(self, bot):
+        while True:
+            try:
+                await asyncio.wait_for(self.flush_requested.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.flush_requested.clear()
+            try:
+                await self.flush(bot)
+            except Exception as e:
+                print(f"Error sending admin digest: {e}")
+
+    async def flush(self, bot):
+        """Log the buffered events and send them to the admin as one digest."""
+        events, self.pending = self.pending, []
+        if not events:
+            return
+        await asyncio.to_thread(self._append_log, events)
+        if self.admin_chat_id:
+            header = f"📋 {len(events)} user events:\n\n"
+            await get_outbox(bot).send_lines(self.admin_chat_id, (_describe(event) for event in events), header=header)
+
+    def _append_log(self, events):
+        with open(self.log_path, 'a', encoding='utf-8') as log_file:
+            for event in events:
+                log_file.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+def _describe(event):
+    """One digest line for an event, in the wording of the old per-event admin messages."""
+    details = {key: value for key, value in event.items() if key not in ('time', 'event', 'user_id')}
+    line = (f"{datetime.fromtimestamp(event['time']).strftime('%H:%M:%S')} User({event['user_id']}) "
+            f"{EVENT_DESCRIPTIONS.get(event['event'], event['event'])}")
+    if details:
+        line += ' ' + ', '.join(f"{key}: {value}" for key, value in details.items())
+    return line + '\n'
+
+
+def get_admin_events():
+    """Return the process-wide admin event bus."""
+    global _event_bus
+    if _event_bus is None:
+        _event_bus = AdminEventBus(get_settings().admin_id)
+    return _event_bus
+
+
+def notify_admin(event, user_id, **fields):
+    """Queue an event for the admin digest without waiting for it to be sent."""
+    get_admin_events().publish(event, user_id, **fields)
@@ -0,0 +1,166 @@
+"""Scan many wallets from the command line and write one JSON line per wallet.
+
+    python batch_scan.py --file wallets.txt --output results.jsonl
+    python batch_scan.py --users --store --output users.jsonl
+    python batch_scan.py --file whales.txt --stream
+
+Histories are fetched concurrently under the same explorer rate limit the bot uses, and
+classification runs in a process pool. With --stream each history is classified page by page as
+it arrives instead, so memory stays bounded even for wallets with millions of transfers.
+The output doubles as the checkpoint: a rerun with the same --output skips every wallet that
+already has a result and retries the ones that failed.
+The scan runs in its own process, so give it spare API keys or a lower API_RATE_LIMIT while the bot runs.
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+from bscscan import close_client
+from mongo import iter_user_wallets
+from main_utils import (get_bep20_transactions, sync_wallet_transactions, load_wallet_transactions, classify_indices,
+                        calculate_balance_and_usd, get_process_pool, shutdown_process_pool)
+from transactions import TransactionBatch
+from transaction_report import find_spam
+from scan_stream import StreamTotals, stream_scan
+from token_reputation import get_token_index
+from settings import get_settings
+
+CONCURRENCY = 8  # Wallets fetched at the same time
+SYNC_EVERY = 100  # Results written between fsyncs of the output
+PROGRESS_EVERY = 100  # Wallets between progress lines on stderr
+ADDRESS_PATTERN = re.compile(r'^0x[0-9a-fA-F]{40}$')
+
+
+def summarize_wallet(transactions, wallet_address, valid_tokens, blocked_contracts):
+    """Classify a TransactionBatch and reduce it to a JSON-ready summary; runs in the process pool."""
+    valid_indices, invalid_indices = classify_indices(transactions, wallet_address, valid_tokens, blocked_contracts)
+    valid_transactions, invalid_transactions = transactions.take(valid_indices), transactions.take(invalid_indices)
+    spam_transactions, invalid_tokens = find_spam(invalid_transactions)
+    return {
+        'transactions': len(transactions),
+        'valid': len(valid_transactions),
+        'invalid': len(invalid_transactions),
+        'spam': len(spam_transactions),
+        'balance': calculate_balance_and_usd(valid_transactions, wallet_address),
+        'suspicious_tokens': invalid_tokens,
+    }
+
+
+def read_wallets(args):
+    """Yield wallet addresses from --file or from the users collection."""
+    if args.users:
+        yield from iter_user_wallets()
+        return
+    with open(args.file, encoding='utf-8') as wallet_file:
+        for line in wallet_file:
+            address = line.split('#', 1)[0].strip()
+            if address:
+                yield address
+
+
+def read_checkpoint(path):
+    """Return the wallets that already have a result in the output, dropping a line cut off by a crash."""
+    done = set()
+    if path == '-' or not os.path.exists(path):
+        return done
+    with open(path, 'rb+') as output:
+        lines = output.read().split(b'\n')
+        if lines[-1]:
+            output.truncate(output.tell() - len(lines[-1]))
+        for line in lines[:-1]:
+            record = json.loads(line)
+            if 'error' not in record:
+                done.add(record['wallet'])
+    return done
+
+
+async def scan_one(wallet_address, store, stream):
+    """Fetch a wallet's history and summarise it in the process pool, or page by page when streaming."""
+    wallet = wallet_address.lower()
+    if stream:
+        totals = StreamTotals(wallet_address)
+        async for _ in stream_scan(wallet_address, totals=totals):
+            pass
+        return totals.summary()
+    if store:
+        await sync_wallet_transactions(wallet)
+        transactions = await asyncio.to_thread(load_wallet_transactions, wallet)
+    else:
+        transactions = TransactionBatch.from_api(await get_bep20_transactions(wallet))
+    # Forged and spam tokens are judged like the bot does, from the shared token index
+    token_index = get_token_index()
+    await token_index.refresh()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_process_pool(), summarize_wallet, transactions, wallet_address, get_settings().valid_tokens,
+        token_index.blocked_for(transactions))
+
+
+async def run(args):
+    done = read_checkpoint(args.output)
+    output = sys.stdout if args.output == '-' else open(args.output, 'a', encoding='utf-8')
+    wallets = iter(read_wallets(args))
+    seen = set(done)
+    counts = {'scanned': 0, 'failed': 0, 'skipped': len(done)}
+    started = time.monotonic()
+
+    def write(record):
+        output.write(json.dumps(record, ensure_ascii=False) + '\n')
+        output.flush()
+        written = counts['scanned'] + counts['failed']
+        if output is not sys.stdout and written % SYNC_EVERY == 0:
+            os.fsync(output.fileno())
+        if written % PROGRESS_EVERY == 0:
+            elapsed = time.monotonic() - started
+            print(f"{counts['scanned']} scanned, {counts['failed']} failed, {counts['skipped']} skipped "
+                  f"({written / elapsed:.1f} wallets/s)", file=sys.stderr)
+
+    async def worker():
+        # Pull addresses lazily so a list of 100k wallets never becomes 100k pending tasks
+        for wallet_address in wallets:
+            wallet = wallet_address.lower()
+            if wallet in seen:
+                continue
+            seen.add(wallet)
+            record = {'wallet': wallet, 'scanned_at': int(time.time())}
+            if not ADDRESS_PATTERN.match(wallet_address):
+                record['error'] = 'Not a wallet address'
+            else:
+                try:
+                    record.update(await scan_one(wallet_address, args.store, args.stream))
+                except Exception as e:
+                    record['error'] = f"{type(e).__name__}: {e}"
+            counts['failed' if 'error' in record else 'scanned'] += 1
+            write(record)
+
+    try:
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+    finally:
+        if output is not sys.stdout:
+            os.fsync(output.fileno())
+            output.close()
+        await close_client()
+        shutdown_process_pool()
+    print(f"Done: {counts['scanned']} scanned, {counts['failed']} failed, {counts['skipped']} skipped "
+          f"in {time.monotonic() - started:.0f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--file', help="file with one wallet address per line")
+    source.add_argument('--users', action='store_true', help="scan the wallet of every registered user")
+    parser.add_argument('--output', default='batch_scan.jsonl', help="JSONL results and checkpoint, - for stdout")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="wallets fetched at the same time")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument('--store', action='store_true',
+                      help="keep histories in the transaction store, so later runs only fetch new blocks")
+    mode.add_argument('--stream', action='store_true', help="classify each history page by page as it arrives")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
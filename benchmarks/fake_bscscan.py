@@ -0,0 +1,285 @@
+"""Local stand-in for the BscScan `tokentx` and `eth_blockNumber` endpoints.
+
+Serves synthetic wallets with a realistic mix of transfers: payments in and out, replaced
+transactions with out-of-order nonces, zero-value address poisoning, fake-token airdrops and
+fake stablecoins. Pagination follows the explorer, including its 10000 result window, and
+latency, rate limiting and random failures can be injected.
+
+    python -m benchmarks.fake_bscscan --wallet 0x...:10000 --port 8545 --latency 0.05
+
+then run the bot or the benchmarks with BSCSCAN_API_URL=http://127.0.0.1:8545/api.
+"""
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from request_scheduler import TokenBucket
+
+MAX_RESULT_WINDOW = 10000
+FIRST_BLOCK = 8000000
+LATEST_BLOCK = 50000000
+FIRST_TIMESTAMP = int(datetime(2021, 6, 1, tzinfo=timezone.utc).timestamp())
+BLOCK_TIME = 3  # Seconds between blocks
+
+# Kinds of synthetic transfers
+INCOMING = 0  # A valid token received from a counterparty
+OUTGOING = 1  # A valid token sent by the wallet with its next nonce
+REPLACED = 2  # A valid token sent by the wallet with an older nonce, invalidating later transfers
+POISON = 3  # Zero-value transfer "from" the wallet to a lookalike address (address poisoning)
+AIRDROP = 4  # Worthless token with a scam name sent to the wallet
+FAKE_STABLE = 5  # Token with a valid symbol but a counterfeit contract sent to the wallet
+
+# Share of each kind in a wallet's history; spam makes up about a third, as on real targeted wallets
+KIND_WEIGHTS = {INCOMING: 35, OUTGOING: 27, REPLACED: 3, POISON: 15, AIRDROP: 15, FAKE_STABLE: 5}
+SAME_BLOCK_RATE = 0.1  # Transfers that land in the same block as the previous one
+
+VALID_TOKENS = [
+    ('BSC-USD', 'Binance-Peg BSC-USD', '0x55d398326f99059ff775485246999027b3197955', 18),
+    ('USDC', 'Binance-Peg USD Coin', '0x8ac76a51cc950d9822d68b83fe1ad97b32cd580d', 18),
+]
+SPAM_TOKENS = [
+    ('Visit usdt-airdrop.com to claim', 'USDT Airdrop'),
+    ('ＵSDT', 'Tether USD'),
+    ('USDC.e', 'USD Coin'),
+    ('$ CLAIM-REWARD.ORG', 'Reward'),
+    ('BNB-Bonus', 'BNB Bonus'),
+]
+
+ERROR_RESPONSES = [
+    (200, {'status': '0', 'message': 'NOTOK', 'result': 'Max rate limit reached'}),
+    (502, {'status': '0', 'message': 'NOTOK', 'result': 'Bad gateway'}),
+]
+
+
+def _address(rng):
+    return f"0x{rng.getrandbits(160):040x}"
+
+
+class SyntheticWallet:
+    """A deterministic token transfer history of `size` rows for one address.
+
+    Only compact columns are kept in memory; explorer rows are rendered when they are served.
+    """
+
+    def __init__(self, address, size, seed=0):
+        self.address = address.lower()
+        self.size = size
+        rng = random.Random(seed)
+
+        counterparties = [_address(rng) for _ in range(500)]
+        lookalikes = [self.address[:6] + _address(rng)[6:-4] + self.address[-4:] for _ in range(50)]
+        fake_contracts = [_address(rng) for _ in range(len(SPAM_TOKENS) + len(VALID_TOKENS))]
+        self.addresses = counterparties + lookalikes + fake_contracts
+        self.lookalike_base = len(counterparties)
+        self.fake_contract_base = len(counterparties) + len(lookalikes)
+
+        self.blocks = array('q')
+        self.kinds = array('b')
+        self.tokens = array('b')  # Index into VALID_TOKENS or SPAM_TOKENS depending on the kind
+        self.others = array('l')  # Index into self.addresses of the other side of the transfer
+        self.nonces = array('q')
+        self.amounts = array('q')  # Token amount in cents
+
+        kinds, weights = zip(*KIND_WEIGHTS.items())
+        starts = sorted(rng.randrange(FIRST_BLOCK, LATEST_BLOCK) for _ in range(size))
+        own_nonce = 0
+        for i in range(size):
+            kind = rng.choices(kinds, weights)[0]
+            if kind == REPLACED and own_nonce < 3:
+                kind = OUTGOING
+            block = self.blocks[-1] if i and rng.random() < SAME_BLOCK_RATE else starts[i]
+            self.blocks.append(block)
+            self.kinds.append(kind)
+
+            if kind == OUTGOING:
+                own_nonce += 1
+                nonce = own_nonce
+            elif kind == REPLACED:
+                nonce = own_nonce - rng.randint(1, 2)
+            else:
+                nonce = rng.randrange(100000)
+            self.nonces.append(nonce)
+
+            if kind == AIRDROP:
+                self.tokens.append(rng.randrange(len(SPAM_TOKENS)))
+                self.others.append(self.lookalike_base + rng.randrange(len(lookalikes)))
+                self.amounts.append(rng.randint(1, 10 ** 8))
+            elif kind == POISON:
+                self.tokens.append(rng.randrange(len(VALID_TOKENS)))
+                self.others.append(self.lookalike_base + rng.randrange(len(lookalikes)))
+                self.amounts.append(0)
+            else:
+                self.tokens.append(rng.randrange(len(VALID_TOKENS)))
+                self.others.append(rng.randrange(len(counterparties)))
+                self.amounts.append(rng.randint(1, 500000))
+
+    def select(self, start_block, end_block, page, offset):
+        """Rows between two blocks (inclusive), oldest first, paginated like the explorer."""
+        first = bisect_left(self.blocks, start_block)
+        last = bisect_right(self.blocks, end_block)
+        start = first + (page - 1) * offset
+        return [self.row(i) for i in range(start, min(start + offset, last))]
+
+    def row(self, i):
+        """Render transfer `i` the way the explorer returns it."""
+        kind = self.kinds[i]
+        block = self.blocks[i]
+        other = self.addresses[self.others[i]]
+        if kind == AIRDROP:
+            symbol, name = SPAM_TOKENS[self.tokens[i]]
+            contract, decimals = self.addresses[self.fake_contract_base + self.tokens[i]], 18
+        else:
+            symbol, name, contract, decimals = VALID_TOKENS[self.tokens[i]]
+            if kind in (POISON, FAKE_STABLE):
+                contract = self.addresses[self.fake_contract_base + len(SPAM_TOKENS) + self.tokens[i]]
+
+        if kind in (OUTGOING, REPLACED, POISON):
+            from_address, to_address = self.address, other
+        else:
+            from_address, to_address = other, self.address
+
+        tx_hash = '0x' + hashlib.sha256(f"{self.address}:{i}".encode()).hexdigest()
+        return {
+            'blockNumber': str(block),
+            'timeStamp': str(FIRST_TIMESTAMP + (block - FIRST_BLOCK) * BLOCK_TIME),
+            'hash': tx_hash,
+            'nonce': str(self.nonces[i]),
+            'blockHash': '0x' + hashlib.sha256(str(block).encode()).hexdigest(),
+            'from': from_address,
+            'contractAddress': contract,
+            'to': to_address,
+            'value': str(self.amounts[i] * 10 ** (decimals - 2)),
+            'tokenName': name,
+            'tokenSymbol': symbol,
+            'tokenDecimal': str(decimals),
+            'transactionIndex': str(i % 200),
+            'gas': '90000',
+            'gasPrice': '3000000000',
+            'gasUsed': '51000',
+            'cumulativeGasUsed': str(51000 * (i % 200 + 1)),
+            'input': 'deprecated',
+            'confirmations': str(LATEST_BLOCK - block + 1),
+        }
+
+
+class StandInExplorer:
+    """Answers explorer API queries from synthetic wallets, with optional latency and failures."""
+
+    def __init__(self, wallets, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0, seed=0):
+        self.wallets = {wallet.address: wallet for wallet in wallets}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit  # Requests per second allowed per API key, 0 for no limit
+        self.rng = random.Random(seed)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def respond(self, params):
+        """Return the HTTP status and JSON body for a query."""
+        with self.lock:
+            self.requests += 1
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+            failure = self.rng.random() < self.error_rate
+            limited = self.rate_limit and not self.buckets.setdefault(
+                params.get('apikey', ''), TokenBucket(self.rate_limit, self.rate_limit)).try_take()
+        if delay:
+            time.sleep(delay)
+        if limited:
+            return ERROR_RESPONSES[0]
+        if failure:
+            return self.rng.choice(ERROR_RESPONSES)
+
+        if params.get('module') == 'proxy' and params.get('action') == 'eth_blockNumber':
+            return 200, {'jsonrpc': '2.0', 'id': 83, 'result': hex(LATEST_BLOCK)}
+        if params.get('module') != 'account' or params.get('action') != 'tokentx':
+            return 200, {'status': '0', 'message': 'NOTOK', 'result': 'Error! Missing Or invalid Module name'}
+
+        try:
+            page = int(params.get('page', 1))
+            offset = int(params.get('offset', MAX_RESULT_WINDOW))
+            start_block = int(params.get('startblock', 0))
+            end_block = int(params.get('endblock', 99999999))
+        except ValueError:
+            return 200, {'status': '0', 'message': 'NOTOK', 'result': 'Error! Invalid parameter'}
+        if page * offset > MAX_RESULT_WINDOW:
+            return 200, {'status': '0', 'message': 'NOTOK',
+                         'result': 'Result window is too large, PageNo x Offset size must be less than or equal to 10000'}
+
+        wallet = self.wallets.get(params.get('address', '').lower())
+        rows = wallet.select(start_block, end_block, page, offset) if wallet else []
+        if not rows:
+            return 200, {'status': '0', 'message': 'No transactions found', 'result': []}
+        return 200, {'status': '1', 'message': 'OK', 'result': rows}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep-alive, so the bot's connection pool is exercised too
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != '/api':
+            self.send_error(404)
+            return
+        status, body = self.server.explorer.respond(dict(parse_qsl(url.query)))
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        try:
+            self.wfile.write(payload)
+        except ConnectionError:
+            pass  # The client timed out and went away
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(explorer, host='127.0.0.1', port=0):
+    """Start serving in a background thread and return the server; its URL is server.url."""
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.explorer = explorer
+    server.url = f"http://{host}:{server.server_address[1]}/api"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def parse_wallet(spec):
+    """Parse an `address:size[:seed]` wallet option."""
+    address, size, *seed = spec.split(':')
+    return SyntheticWallet(address, int(size), int(seed[0]) if seed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--wallet', action='append', type=parse_wallet, default=[],
+                        help="synthetic wallet as address:size[:seed], may be repeated")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help="0 picks a free port")
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra latency, up to this many seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument('--rate-limit', type=float, default=0, help="requests per second per API key")
+    args = parser.parse_args()
+
+    explorer = StandInExplorer(args.wallet, args.latency, args.jitter, args.error_rate, args.rate_limit)
+    server = serve(explorer, args.host, args.port)
+    print(f"Serving on {server.url}", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""Offline scan benchmarks against the local BscScan stand-in.
+
+Times fetching, batch building, classification, balance totals, message and CSV rendering, the
+streaming fetch-classify-render pipeline and (when MongoDB is reachable) payment verification for
+synthetic wallets of several sizes, and reports throughput and peak Python memory of each stage
+next to the stored baseline.
+
+    python -m benchmarks.run_benchmarks --sizes 1000,10000,100000,1000000
+    python -m benchmarks.run_benchmarks --save-baseline
+
+Baselines are machine-specific; refresh them with --save-baseline when the hardware changes.
+Exits with status 1 when a stage is slower than its baseline by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+import tracemalloc
+from request_scheduler import REQUESTS_PER_SECOND
+
+SIZES = (1000, 10000, 100000, 1000000)
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+TOLERANCE = 0.25  # Allowed slowdown against the baseline before a stage counts as a regression
+BENCH_DATABASE = 'wallet_db_benchmark'  # Never the bot's own database, it is dropped afterwards
+BENCH_USER_ID = -1
+PAYMENT_TOKENS = ('BSC-USD', 'USDC')
+
+
+def wallet_address(size):
+    """Synthetic wallet served for a given history size."""
+    return f"0x{size:040x}"
+
+
+def start_stand_in(sizes, args):
+    """Run the stand-in explorer in a child process, so its allocations stay out of the measurements."""
+    command = [sys.executable, '-m', 'benchmarks.fake_bscscan', '--latency', str(args.latency),
+               '--jitter', str(args.jitter), '--error-rate', str(args.error_rate), '--rate-limit', str(args.rate_limit)]
+    for size in sizes:
+        command += ['--wallet', f"{wallet_address(size)}:{size}:{size}"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith('Serving on '):
+        process.kill()
+        raise RuntimeError("The BscScan stand-in did not start")
+    return process, line.split()[-1]
+
+
+def mongo_available(uri):
+    from pymongo import MongoClient
+    try:
+        MongoClient(uri, serverSelectionTimeoutMS=1000).admin.command('ping')
+    except Exception:
+        return False
+    return True
+
+
+async def measure(stage, rows, function, repeat):
+    """Time the best of `repeat` runs, then run once more under tracemalloc for the peak memory."""
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        if asyncio.iscoroutine(result):
+            result = await result
+        best = min(best, time.perf_counter() - started)
+
+    tracemalloc.start()
+    try:
+        result = function()
+        if asyncio.iscoroutine(result):
+            result = await result
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    rows = rows(result) if callable(rows) else rows
+    return result, {'stage': stage, 'rows': rows, 'seconds': best,
+                    'rows_per_second': rows / best if best else 0.0, 'peak_mb': peak / 2 ** 20}
+
+
+async def benchmark_size(size, repeat, with_mongo):
+    from main_utils import get_bep20_transactions, classify_transactions, calculate_balance_and_usd
+    from token_reputation import get_token_index
+    from transactions import TransactionBatch
+    from transaction_report import format_transaction_line, build_csv
+    from telegram_output import pack_lines
+
+    wallet = wallet_address(size)
+    results = []
+
+    rows, result = await measure('fetch', len, lambda: get_bep20_transactions(wallet), repeat)
+    results.append(result)
+    batch, result = await measure('batch', size, lambda: TransactionBatch.from_api(rows), repeat)
+    results.append(result)
+    # Forged tokens are blocked like in the streamed and the bot's scans, so all stages agree
+    token_index = get_token_index()
+    await token_index.refresh()
+    (valid, invalid), result = await measure(
+        'classify', size, lambda: classify_transactions(batch, wallet, token_index.blocked_for(batch)), repeat)
+    results.append(result)
+    _, result = await measure('balance', len(valid), lambda: calculate_balance_and_usd(valid, wallet), repeat)
+    results.append(result)
+
+    spam = [tx for tx in invalid if tx.amount > 0]
+
+    def render_lines():
+        lines = [format_transaction_line(tx, wallet, show_nonce=True) for tx in valid]
+        lines += [format_transaction_line(tx, wallet) for tx in spam]
+        return list(pack_lines(lines))
+
+    _, result = await measure('render_lines', len(valid) + len(spam), render_lines, repeat)
+    results.append(result)
+    _, result = await measure('render_csv', len(valid) + len(spam),
+                              lambda: (build_csv(valid, wallet), build_csv(spam, wallet)), repeat)
+    results.append(result)
+
+    streamed_valid, result = await benchmark_stream(wallet, size, repeat)
+    if streamed_valid != len(valid):
+        raise RuntimeError(f"The streamed scan found {streamed_valid} valid transfers instead of {len(valid)}")
+    results.append(result)
+
+    if with_mongo:
+        results += await benchmark_verify(size, rows)
+    return results
+
+
+async def benchmark_stream(wallet, size, repeat):
+    """Stream the valid-transfers CSV of a wallet into nothing, noting how soon its first rows were ready."""
+    from scan_stream import StreamTotals, stream_scan, render_csv
+    first_output = []
+
+    async def stream():
+        totals = StreamTotals(wallet)
+        started = time.perf_counter()
+        first = True
+        async for chunk in render_csv(stream_scan(wallet, totals=totals), wallet):
+            if first and chunk.count('\n') > 1:
+                first_output.append(time.perf_counter() - started)
+                first = False
+        return totals.valid
+
+    valid, result = await measure('stream', size, stream, repeat)
+    result['first_output_seconds'] = min(first_output, default=None)  # The traced run is the slowest
+    return valid, result
+
+
+async def benchmark_verify(size, rows):
+    """Verify a payment into the size's wallet, first with an empty store and then incrementally."""
+    from settings import get_settings
+    from mongo import transactions_collection, sync_collection, payments_collection
+    from main_utils import verify_user_payment
+
+    wallet = wallet_address(size)
+    os.environ['WALLET_ADDRESS'] = wallet
+    get_settings.cache_clear()
+
+    genuine_contracts = set(get_settings().token_contracts)
+    payment = next((row for row in rows if row['to'] == wallet and row['tokenSymbol'] in PAYMENT_TOKENS
+                    and (row['tokenSymbol'], row['contractAddress'].lower()) in genuine_contracts
+                    and int(row['value']) >= 10 * 10 ** int(row['tokenDecimal'])), None)
+    if payment is None:
+        return []
+
+    def reset(full):
+        payments_collection.delete_many({})
+        if full:
+            transactions_collection.delete_many({'wallet': wallet})
+            sync_collection.delete_many({'wallet': wallet})
+
+    async def verify(full):
+        reset(full)
+        started = time.perf_counter()
+        verified = await verify_user_payment(BENCH_USER_ID, payment['from'], payment['hash'])
+        elapsed = time.perf_counter() - started
+        if not verified:
+            raise RuntimeError(f"Payment {payment['hash']} was not verified")
+        return elapsed
+
+    results = []
+    for stage, full, rows_count in (('verify_cold', True, size), ('verify_warm', False, 1)):
+        seconds = await verify(full)
+        results.append({'stage': stage, 'rows': rows_count, 'seconds': seconds,
+                        'rows_per_second': rows_count / seconds, 'peak_mb': None})
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print the results next to the baseline and return the number of regressions."""
+    regressions = 0
+    print(f"{'stage':<14}{'size':>9}{'seconds':>11}{'rows/s':>13}{'peak MB':>10}  vs baseline")
+    for result in results:
+        key = f"{result['stage']}/{result['size']}"
+        reference = baseline.get(key)
+        change = ''
+        if reference:
+            ratio = result['seconds'] / reference['seconds'] - 1
+            change = f"{ratio:+.0%}"
+            if ratio > tolerance:
+                change += '  REGRESSION'
+                regressions += 1
+        peak = f"{result['peak_mb']:.1f}" if result['peak_mb'] is not None else '-'
+        first = result.get('first_output_seconds')
+        if first is not None:
+            change += f"  (first rows after {first:.3f}s)"
+        print(f"{result['stage']:<14}{result['size']:>9}{result['seconds']:>11.4f}"
+              f"{result['rows_per_second']:>13,.0f}{peak:>10}  {change}")
+    return regressions
+
+
+async def run(sizes, repeat, with_mongo):
+    from bscscan import close_client
+    results = []
+    try:
+        for size in sizes:
+            for result in await benchmark_size(size, repeat, with_mongo):
+                results.append({'size': size, **result})
+    finally:
+        await close_client()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help="comma-separated wallet sizes")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per stage, the best one is reported")
+    parser.add_argument('--latency', type=float, default=0.0, help="stand-in latency per request in seconds")
+    parser.add_argument('--jitter', type=float, default=0.0, help="random extra stand-in latency in seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of stand-in requests that fail")
+    parser.add_argument('--rate-limit', type=float, default=0, help="stand-in requests per second per API key")
+    parser.add_argument('--api-rate', type=float, default=REQUESTS_PER_SECOND,
+                        help="requests per second the bot's scheduler allows")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="store these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    process, url = start_stand_in(sizes, args)
+    try:
+        # Set before the bot's modules read their settings; load_dotenv never overrides these
+        os.environ.update({
+            'BSCSCAN_API_URL': url,
+            'API_KEY': 'benchmark',
+            'API_RATE_LIMIT': str(args.api_rate),
+            'VALID_TOKENS': ','.join(PAYMENT_TOKENS),
+            'MONGODB_DATABASE': BENCH_DATABASE,
+        })
+        from settings import get_settings
+        with_mongo = mongo_available(get_settings().mongodb_uri)
+        if not with_mongo:
+            print("MongoDB is not reachable, skipping the payment verification stages")
+
+        results = asyncio.run(run(sizes, args.repeat, with_mongo))
+        if with_mongo:
+            from mongo import mongo_client
+            mongo_client.drop_database(BENCH_DATABASE)
+    finally:
+        process.terminate()
+        process.wait()
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+    regressions = compare(results, baseline, args.tolerance)
+
+    if args.save_baseline:
+        baseline.update({f"{result['stage']}/{result['size']}": result for result in results})
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'results': baseline}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{regressions} stage(s) slower than the baseline by more than {args.tolerance:.0%}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+import asyncio
+import httpx
+from request_scheduler import NORMAL, get_scheduler
+from settings import get_settings
+from metrics import BSCSCAN_REQUEST_SECONDS, BSCSCAN_ERRORS
+
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0  # Seconds before the first retry, doubled on every attempt
+
+# Explorer answers status '0' with this message for wallets without transfers
+EMPTY_RESULT_MESSAGES = ('No transactions found', 'No records found')
+
+_client = None
+
+
+class BscScanError(Exception):
+    """Raised when the explorer keeps failing after all retries."""
+
+
+def get_client():
+    """Return the shared keep-alive HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            # Waiting for a pooled connection isn't an explorer failure; the request scheduler paces callers
+            timeout=httpx.Timeout(10.0, connect=5.0, pool=None),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+    return _client
+
+
+async def close_client():
+    """Close the shared HTTP client and its pooled connections."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def call_api(params, owner=None, priority=NORMAL):
+    """Call the explorer API and return the decoded response, retrying with backoff.
+
+    Every attempt waits for a slot from the request scheduler, which also picks the API key to use.
+    """
+    delay = RETRY_BACKOFF
+    action = params.get('action')
+
+    for attempt in range(1, MAX_RETRIES + 1):
+        api_key = await get_scheduler().acquire(owner, priority)
+        try:
+            with BSCSCAN_REQUEST_SECONDS.time(action=action):
+                response = await get_client().get(get_settings().bscscan_api_url, params={**params, 'apikey': api_key})
+            response.raise_for_status()
+            data = response.json()
+        except httpx.HTTPStatusError as e:
+            error = f"HTTP {e.response.status_code}"  # The request URL carries the API key, keep it out of logs
+        except (httpx.HTTPError, ValueError) as e:
+            error = type(e).__name__
+        else:
+            if data.get('status') == '1' or data.get('message') in EMPTY_RESULT_MESSAGES:
+                return data
+            if 'jsonrpc' in data and 'error' not in data:  # module=proxy answers in JSON-RPC form
+                return data
+            error = f"{data.get('message', 'Unknown error')}: {data.get('result')}"
+
+        BSCSCAN_ERRORS.inc(action=action)
+        if attempt == MAX_RETRIES:
+            raise BscScanError(error)
+        print(f"BscScan request failed ({error}), retrying in {delay:g}s")
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+async def get_token_transfers(wallet_address, start_block, end_block, page, offset, priority=NORMAL):
+    """Fetch one page of BEP20 token transfers for a wallet, oldest first."""
+    data = await call_api({
+        'module': 'account',
+        'action': 'tokentx',
+        'address': wallet_address,
+        'startblock': start_block,
+        'endblock': end_block,
+        'page': page,
+        'offset': offset,
+        'sort': 'asc',
+    }, owner=wallet_address, priority=priority)
+    return data['result'] or []
+
+
+async def get_latest_block(owner=None, priority=NORMAL):
+    """Return the number of the most recent block on the chain."""
+    data = await call_api({'module': 'proxy', 'action': 'eth_blockNumber'}, owner=owner, priority=priority)
+    return int(data['result'], 16)
@@ -1,30 +1,74 @@
-import httpx
-import os
-import asyncio
-from dotenv import load_dotenv
 from telegram.ext import ApplicationBuilder
-from main_handlers import start, show_necessity, set_wallet, change_wallet, check_valid_transactions, check_invalid_transactions, handle_message
+from bscscan import close_client
+from mongo import ensure_indexes
+from admin_events import get_admin_events
+from settings import get_settings, logo
+from metrics import start_metrics_server, stop_metrics_server
+from main_utils import shutdown_process_pool
+from wallet_watcher import get_watcher
+from webhook import serve_webhook, worker_index
+from main_handlers import start, show_necessity, set_wallet, change_wallet, check_valid_transactions, check_invalid_transactions, cancel_scan, browse_results, toggle_alerts, handle_message
 from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 
 
-# Load environment variables
-load_dotenv()
+async def startup(application):
+    """Prepare the database and load the welcome image before the bot starts handling updates."""
+    ensure_indexes()
+    logo.load()
+    get_admin_events().start(application.bot)
+    if get_settings().metrics_port:
+        await start_metrics_server('127.0.0.1', get_settings().metrics_port + worker_index())
+    if get_settings().watch_wallets and worker_index() == 0:
+        get_watcher().start(application.bot)  # One watcher is enough, whichever worker a user's taps reach
 
-def run_bot():
-    timeout = httpx.Timeout(10.0, connect=5.0)
+async def stopping(application):
+    """Stop background checks and flush pending admin events while the bot can still send messages."""
+    await get_watcher().stop()
+    await get_admin_events().stop(application.bot)
+
+async def shutdown(application):
+    """Release pooled explorer connections and worker processes when the bot stops."""
+    await stop_metrics_server()
+    await close_client()
+    shutdown_process_pool()
 
-    application = ApplicationBuilder().token(os.getenv("TELEGRAM_TOKEN")).build()
+def build_application():
+    settings = get_settings()
+
+    # Handle updates concurrently so one user's wallet scan doesn't block everyone else
+    builder = (
+        ApplicationBuilder()
+        .token(settings.telegram_token)
+        .concurrent_updates(settings.concurrent_updates)
+        .post_init(startup)
+        .post_stop(stopping)
+        .post_shutdown(shutdown)
+    )
+    if settings.webhook_url:
+        builder.updater(None)  # Updates arrive through webhook.py instead of getUpdates
+    application = builder.build()
 
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("alerts", toggle_alerts))
     application.add_handler(CallbackQueryHandler(show_necessity, pattern='show_necessity'))
     application.add_handler(CallbackQueryHandler(set_wallet, pattern='set_wallet'))
     application.add_handler(CallbackQueryHandler(change_wallet, pattern='change_wallet'))
     application.add_handler(CallbackQueryHandler(check_valid_transactions, pattern='check_valid_transactions'))
     application.add_handler(CallbackQueryHandler(check_invalid_transactions, pattern='check_invalid_transactions'))
+    application.add_handler(CallbackQueryHandler(cancel_scan, pattern='cancel_scan'))
+    application.add_handler(CallbackQueryHandler(browse_results, pattern='^browse:'))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
 
-    # Run the bot
-    asyncio.run(application.run_polling())
+def run_bot():
+    settings = get_settings()
+    if settings.webhook_url:
+        serve_webhook(build_application)
+    elif settings.workers > 1:
+        raise SystemExit("Several workers need webhook mode: set WEBHOOK_URL, only one process can poll for updates")
+    else:
+        # run_polling manages its own event loop
+        build_application().run_polling()
 
 if __name__ == "__main__":
-    run_bot()
\ No newline at end of file
+    run_bot()
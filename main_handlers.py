@@ -1,15 +1,22 @@
-import os
-import asyncio
-import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
 from telegram.ext import ContextTypes, CallbackQueryHandler, MessageHandler, filters
 from datetime import datetime
-from mongo import find_user, add_or_update_user, check_user_paid
-from main_utils import get_bep20_transactions, classify_transactions, calculate_balance_and_usd, verify_user_payment
-
+from mongo import find_user, add_or_update_user, check_user_paid, set_user_alerts
+from main_utils import verify_user_payment
+from telegram_output import get_outbox
+from admin_events import notify_admin
+from scan_jobs import ATTACHED, DUPLICATE, get_job_manager
+from transaction_report import build_csv
+from result_browser import VALID, INVALID, EXPORT, get_browser, parse_callback_data, clamp_filter, render_page, render
+from token_reputation import get_token_index, describe_token
+from settings import get_settings, logo
+from metrics import HANDLER_SECONDS, RENDER_SECONDS
+
+@HANDLER_SECONDS.time(handler='start')
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
-    user = find_user(user_id)  # Fetch the user from the database
+    user = await find_user(user_id)  # Fetch the user from the database
     
     keyboard = []
     
@@ -25,26 +32,25 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    # await update.message.reply_photo(photo=open('img/mark.webp', 'rb'))  # Send image
+    welcome_message = (
+        f"🗓 Current date and time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
+        "👋 Welcome!\n\n Check the safety of your wallet normally and manage all your financial assets safely.\n\n"
+        f"💼 Your BEP20 Wallet Address: {user['wallet_address'] if user else '❌ Not set'}\n"
+    )
 
+    # One message: the logo with the welcome text as its caption, re-sent by file_id after the first upload
     try:
-        with open('img/mark.webp', 'rb') as photo:
-            await update.message.reply_photo(photo=photo)
+        message = await update.message.reply_photo(photo=logo.photo(), caption=welcome_message, reply_markup=reply_markup)
+        logo.remember(message)
     except Exception as e:
         print(f"Error occurred: {str(e)}")
-
-    await update.message.reply_text(
-        f"🗓 Current date and time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n"
-        "👋 Welcome!\n\n Check the safety of your wallet normally and manage all your financial assets safely.\n\n"
-        f"💼 Your BEP20 Wallet Address: {user['wallet_address'] if user else '❌ Not set'}\n",
-        reply_markup=reply_markup
-    )
+        await update.message.reply_text(welcome_message, reply_markup=reply_markup)
 
     # Send the user's ID to the admin
-    admin_user_id = os.getenv("ADMIN_ID")
-    await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) started the bot.")
+    notify_admin('start', user_id)
 
 
+@HANDLER_SECONDS.time(handler='show_necessity')
 async def show_necessity(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     response_message = (
         "🚨 **Necessity of Safety Check** 🚨\n\n"
@@ -65,190 +71,66 @@ async def show_necessity(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
     # Send the user's ID to the admin
     user_id = update.effective_user.id
-    admin_user_id = os.getenv("ADMIN_ID")
-    await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) watching the necessity of safety check.")
+    notify_admin('show_necessity', user_id)
 
 
+@HANDLER_SECONDS.time(handler='set_wallet')
 async def set_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.callback_query.answer()
     await update.callback_query.message.reply_text("👇 Please send me your BEP20 wallet address.")# Send the user's ID to the admin
     user_id = update.effective_user.id
-    admin_user_id = os.getenv("ADMIN_ID")
-    await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) clicked set_wallet button")
+    notify_admin('set_wallet', user_id)
 
+@HANDLER_SECONDS.time(handler='change_wallet')
 async def change_wallet(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.callback_query.answer()
     await update.callback_query.message.reply_text("👇 Please send me your new BEP20 wallet address.")# Send the user's ID to the admin
     user_id = update.effective_user.id
-    admin_user_id = os.getenv("ADMIN_ID")
-    await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) clicked update_wallet button.")
+    notify_admin('change_wallet', user_id)
 
+@HANDLER_SECONDS.time(handler='check_valid_transactions')
 async def check_valid_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.callback_query.answer()
     user_id = update.effective_user.id
     
     # Send the user's ID to the admin
-    admin_user_id = os.getenv("ADMIN_ID")
-    await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) watching valid transactions.")
+    notify_admin('check_valid', user_id)
 
-    user = find_user(user_id)
+    user = await find_user(user_id)
 
     if user:
-        response_message = (
-            "⏳ Please wait a moment while we get all the valid transactions made using your wallet from the BSC blockchain network.\n\n"
-            "🔍 The longer your wallet has been created and the more transactions your wallet has had, the longer it will take to search for transactions from your wallet."
-        )
-        await update.callback_query.message.reply_text(response_message)
-
         wallet_address = user['wallet_address']
-        transactions = get_bep20_transactions(wallet_address)
-        
-        valid_transactions, invalid_transactions = classify_transactions(transactions, wallet_address)
-        total_balance = calculate_balance_and_usd(valid_transactions, wallet_address)
-
-        valid_tokens_env = os.getenv('VALID_TOKENS', '')
-        valid_tokens = valid_tokens_env.split(',') if valid_tokens_env else []
-
-        response_message = "\n💰 Total Balance:\n\n"
-
-        for token in valid_tokens:
-            if total_balance[token] != 0:
-                response_message += f"{token}: {total_balance[token]}\n"
-
-        await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-
-        response_message = f"✅ Total Valid Transactions: {len(valid_transactions)}\n\n"
-
-        message_count = 0
-        for tx in valid_transactions:
-            transaction_date = datetime.utcfromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S')
-            in_out_symbol = ""
-            if wallet_address == tx['from']:
-                in_out_symbol = "💳➡️"
-            if wallet_address == tx['to']:
-                in_out_symbol = "➡️💳"
-            response_message += (f"{in_out_symbol} Hash: `{tx['hash']}`, From: `{tx['from']}`, To: `{tx['to']}`, "
-                                 f"Value: `{int(tx['value']) / (10 ** int(tx['tokenDecimal'])):.6f} {tx['tokenSymbol']}`, "
-                                 f"Date: `{transaction_date}` {tx['nonce']}\n")
-            message_count+=1
-            if message_count == 15:
-                try:
-                    await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-                except telegram.error.RetryAfter as e:
-                    await update.callback_query.message.reply_text("⏳ Please wait a moment", parse_mode='Markdown')
-                    await asyncio.sleep(e.retry_after)
-                    await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-                message_count = 0
-                response_message = ""
-                await asyncio.sleep(1)
-
-        if response_message != "":
-            await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
+        chat_id = update.effective_chat.id
+        outcome = await get_job_manager().submit(
+            context.bot, chat_id, wallet_address, VALID,
+            lambda scan: send_valid_report(context.bot, chat_id, wallet_address, scan))
+        await reply_scan_outcome(update, outcome)
     else:
         await update.callback_query.message.reply_text("❌ No wallet address found.")
 
+@HANDLER_SECONDS.time(handler='check_invalid_transactions')
 async def check_invalid_transactions(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.callback_query.answer()
     user_id = update.effective_user.id
-    user = find_user(user_id)
+    user = await find_user(user_id)
 
     if user:
-        if check_user_paid(user_id):
+        if await check_user_paid(user_id):
     
             # Send the user's ID to the admin
-            admin_user_id = os.getenv("ADMIN_ID")
-            await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) watching invalid transactions.")
-
-            response_message = "⏳ Please wait a moment while we retrieve and analyze all invalid transactions made using your wallet from the BSC blockchain network.\n\nThe longer your wallet has been created and the more transactions your wallet has had, the longer it will take to search for transactions from your wallet."
-            await update.callback_query.message.reply_text(response_message)
+            notify_admin('check_invalid', user_id)
 
             wallet_address = user['wallet_address']
-            transactions = get_bep20_transactions(wallet_address)
-            
-            valid_transactions, invalid_transactions = classify_transactions(transactions, wallet_address)
-
-            response_message = f"❌ Total Invalid Transactions: {len(invalid_transactions)}\n"
-            response_message += "\n📜 Invalid Transactions:\n"
-            
-            message_count = 0
-            # valid_tokens =  ['BSC-USD', 'USDC', 'USDT', 'LDOGE', 'BNB']
-            # valid_tokens_env = os.getenv('VALID_TOKENS', '')
-            # valid_tokens = valid_tokens_env.split(',') if valid_tokens_env else []
-            invalid_tokens = []
-            spam_transactions_count = 0
-
-            for tx in invalid_transactions:
-                transaction_date = datetime.utcfromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S')
-                transaction_value = int(tx['value']) / (10 ** int(tx['tokenDecimal']))
-                # if tx['tokenSymbol'] not in valid_tokens:
-                in_out_symbol = ""
-                if wallet_address == tx['from']:
-                    in_out_symbol = "💳➡️"
-                if wallet_address == tx['to']:
-                    in_out_symbol = "➡️💳"
-                if transaction_value > 0:
-                    response_message += (f"{in_out_symbol} Hash: `{tx['hash']}`, From: `{tx['from']}`, To: `{tx['to']}`, "
-                                        f"Value: `{transaction_value:.6f} {tx.get('tokenSymbol', 'N/A')}`, "
-                                        f"Date: `{transaction_date}`\n")
-                    if tx['tokenSymbol'] not in invalid_tokens:
-                        invalid_tokens.append(tx['tokenSymbol'])
-                    message_count+=1
-                    spam_transactions_count+=1
-                    if message_count == 15:
-                        try:
-                            await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-                        except telegram.error.RetryAfter as e:
-                            await update.callback_query.message.reply_text("⏳ Please wait a moment", parse_mode='Markdown')
-                            await asyncio.sleep(e.retry_after)
-                            await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-                        message_count = 0
-                        response_message = ""
-                        await asyncio.sleep(1)
-                
-            if response_message != "":
-                await update.callback_query.message.reply_text(response_message, parse_mode='Markdown')
-
-            response_message = (f"⚠️ Never go to the site included in the fake token!\n\n Suspicious tokens: {len(invalid_tokens)}\n\n") 
-            token_no = 0
-            for token in invalid_tokens:
-                token_no += 1
-                response_message += (f"{token_no}. {token.replace('.','[dot]')}\n")
-
-            await update.callback_query.message.reply_text(response_message)
-
-            if len(invalid_tokens) == 0:
-                response_message = "✅ As you can see, your BEP20 wallet is safe.\n\n"
-                response_message += "🔒 There is no attempt or trace of any hacking and there are no spam transactions."
-                await update.callback_query.message.reply_text(response_message)
-            else:
-                response_message = (
-                    f"⚠️ As you can see, there were {spam_transactions_count} intentionally "
-                    "invalid transactions using your wallet, including spam transactions.\n\n"
-                    "🚨 Some invalid token strings also contain forged ASCII characters.\n"
-                    "⚠️ Spam transactions can be made using valid tokens (e.g. USDC) or they "
-                    "can be made using invalid or fraudulent tokens.\nSome of them are likely "
-                    "to show signs of hacking attempts or attempts to target your wallet.\n"
-                    "Most spam transactions significantly reduce the security of your wallet.\n"
-                )
-                await update.callback_query.message.reply_text(response_message)
-                response_message = (
-                    "If the spam transactions are connected to illegitimate tokens or untrustworthy projects, "
-                    "those tokens can cause problems for your wallet.\n\n🔒 Your wallet is therefore not secure.\n\n"
-                    "🚨 We recommend that you transfer funds from your BEP20 wallet to another safe and reliable wallet at the appropriate time.\n\n"
-                    # "ℹ️  You may see many invalid transactions from your wallet on some sites, but most sites do not show invalid transactions, "
-                    # "which are difficult to analyze.\nHowever, we show all invalid transactions except valid transactions and invalid "
-                    # "transactions with zero volume.\n🌟 This provides the most objective information about the wallet."
-                )
-                await update.callback_query.message.reply_text(response_message)
-
-            admin_user_id = os.getenv("ADMIN_ID")
-            await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) checked safety of his wallet.\nHis wallet address is `{wallet_address}`")
+            chat_id = update.effective_chat.id
+            outcome = await get_job_manager().submit(
+                context.bot, chat_id, wallet_address, INVALID,
+                lambda scan: send_invalid_report(context.bot, chat_id, user_id, wallet_address, scan))
+            await reply_scan_outcome(update, outcome)
         else:
             # Send the user's ID to the admin
-            admin_user_id = os.getenv("ADMIN_ID")
-            await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) watching payment help.")
+            notify_admin('payment_help', user_id)
 
-            admin_wallet_address = os.getenv("WALLET_ADDRESS")
+            admin_wallet_address = get_settings().wallet_address
             response_message = (
                 "⚠️ You need to pay at least 10 USDT to check the security of your wallet.\n\n"
                 "🚨 To continue, please read and follow the instructions below carefully.\n\n"
@@ -277,40 +159,181 @@ async def check_invalid_transactions(update: Update, context: ContextTypes.DEFAU
     else:
         await update.callback_query.message.reply_text("❌ No wallet address found.")
 
+async def reply_scan_outcome(update: Update, outcome) -> None:
+    """Tell the user when their request joined a scan that was already running."""
+    if outcome == ATTACHED:
+        await update.callback_query.message.reply_text("⏳ Your wallet is already being scanned. This report will follow as soon as it finishes.")
+    elif outcome == DUPLICATE:
+        await update.callback_query.message.reply_text("⏳ This report is already being prepared. Please wait for the current scan to finish.")
+
+@HANDLER_SECONDS.time(handler='cancel_scan')
+async def cancel_scan(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await update.callback_query.answer()
+    user = await find_user(update.effective_user.id)
+
+    if not (user and get_job_manager().cancel(user['wallet_address'])):
+        await update.callback_query.message.reply_text("ℹ️ There is no scan running for your wallet.")
+
+async def send_valid_report(bot, chat_id, wallet_address, scan):
+    """Send the balance and valid transactions of a finished scan."""
+    total_balance = scan.balance
+
+    outbox = get_outbox(bot)
+
+    response_message = "\n💰 Total Balance:\n\n"
+
+    for token in get_settings().valid_tokens:
+        if total_balance[token] != 0:
+            response_message += f"{token}: {total_balance[token]}\n"
+
+    await outbox.send_message(chat_id, response_message, parse_mode='Markdown')
+
+    # One message with the first page; its buttons page, filter and export the rest
+    with RENDER_SECONDS.time(report='valid_page'):
+        response_message, reply_markup = render_page(get_browser().open(wallet_address, VALID, scan), 0)
+    await outbox.send_message(chat_id, response_message, parse_mode='Markdown', reply_markup=reply_markup)
+
+async def send_invalid_report(bot, chat_id, user_id, wallet_address, scan):
+    """Send the invalid transactions and suspicious tokens of a finished scan."""
+    outbox = get_outbox(bot)
+
+    # The spam transfers and the tokens they used, indexed once for browsing
+    with RENDER_SECONDS.time(report='invalid_page'):
+        index = get_browser().open(wallet_address, INVALID, scan)
+        response_message, reply_markup = render_page(index, 0)
+    await outbox.send_message(chat_id, response_message, parse_mode='Markdown', reply_markup=reply_markup)
+    invalid_tokens = index.tokens
+    spam_transactions_count = len(index)
+
+    response_message = (f"⚠️ Never go to the site included in the fake token!\n\n Suspicious tokens: {len(invalid_tokens)}\n\n") 
+    token_index = get_token_index()
+    lines = (f"{token_no}. {describe_token(contract, symbol, token_index.get(contract))}"
+             for token_no, (contract, symbol) in enumerate(invalid_tokens, 1))
+    await outbox.send_lines(chat_id, lines, header=response_message)
+
+    if len(invalid_tokens) == 0:
+        response_message = "✅ As you can see, your BEP20 wallet is safe.\n\n"
+        response_message += "🔒 There is no attempt or trace of any hacking and there are no spam transactions."
+        await outbox.send_message(chat_id, response_message)
+    else:
+        response_message = (
+            f"⚠️ As you can see, there were {spam_transactions_count} intentionally "
+            "invalid transactions using your wallet, including spam transactions.\n\n"
+            "🚨 Some invalid token strings also contain forged ASCII characters.\n"
+            "⚠️ Spam transactions can be made using valid tokens (e.g. USDC) or they "
+            "can be made using invalid or fraudulent tokens.\nSome of them are likely "
+            "to show signs of hacking attempts or attempts to target your wallet.\n"
+            "Most spam transactions significantly reduce the security of your wallet.\n"
+        )
+        await outbox.send_message(chat_id, response_message)
+        response_message = (
+            "If the spam transactions are connected to illegitimate tokens or untrustworthy projects, "
+            "those tokens can cause problems for your wallet.\n\n🔒 Your wallet is therefore not secure.\n\n"
+            "🚨 We recommend that you transfer funds from your BEP20 wallet to another safe and reliable wallet at the appropriate time.\n\n"
+            # "ℹ️  You may see many invalid transactions from your wallet on some sites, but most sites do not show invalid transactions, "
+            # "which are difficult to analyze.\nHowever, we show all invalid transactions except valid transactions and invalid "
+            # "transactions with zero volume.\n🌟 This provides the most objective information about the wallet."
+        )
+        await outbox.send_message(chat_id, response_message)
+
+    notify_admin('safety_checked', user_id, wallet_address=wallet_address)
+
+@HANDLER_SECONDS.time(handler='browse')
+async def browse_results(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Show another page or filter of a report by editing its message, or send the filtered rows as CSV."""
+    query = update.callback_query
+    report, page, token, direction = parse_callback_data(query.data)
+    user_id = update.effective_user.id
+    user = await find_user(user_id)
+
+    if not user:
+        await query.answer("❌ No wallet address found.", show_alert=True)
+        return
+    if report == INVALID and not await check_user_paid(user_id):
+        await query.answer("⚠️ Your safety check has expired. Please pay again to see the invalid transactions.", show_alert=True)
+        return
+    await query.answer()
+
+    wallet_address = user['wallet_address']
+    chat_id = update.effective_chat.id
+    message_id = query.message.message_id
+    browser = get_browser()
+    index = browser.get(wallet_address, report)
+    if index is None:
+        # The report expired or was sent by another worker process; a scan job rebuilds it from the
+        # stored history, so a burst of taps waits in line with every other scan
+        outcome = await get_job_manager().submit(
+            context.bot, chat_id, wallet_address, f'browse_{report}',
+            lambda scan: show_browsed(context.bot, chat_id, message_id, wallet_address,
+                                      browser.open(wallet_address, report, scan), page, token, direction))
+        await reply_scan_outcome(update, outcome)
+        return
+    await show_browsed(context.bot, chat_id, message_id, wallet_address, index, page, token, direction)
+
+async def show_browsed(bot, chat_id, message_id, wallet_address, index, page, token, direction):
+    """Edit a report message to show the page or token picker a browse button asked for, or send its rows as CSV."""
+    outbox = get_outbox(bot)
+    report = index.report
+    if page == EXPORT:
+        token, direction = clamp_filter(index, token, direction)
+        with RENDER_SECONDS.time(report=f'{report}_csv'):
+            document = build_csv(index.batch.take(index.select(token, direction)), wallet_address)
+        await outbox.send_document(chat_id, document, filename=f'{report}_transactions.csv', caption=f"📎 All {report} transactions")
+        return
+
+    with RENDER_SECONDS.time(report=f'{report}_page'):
+        response_message, reply_markup = render(index, page, token, direction)
+    try:
+        await outbox.edit_message_text(chat_id, message_id, response_message,
+                                       parse_mode='Markdown', reply_markup=reply_markup)
+    except BadRequest as e:
+        print(f"Could not show the {report} transactions page: {e}")
+
+@HANDLER_SECONDS.time(handler='alerts')
+async def toggle_alerts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Switch the new-spam alerts of the user's wallet on or off."""
+    user_id = update.effective_user.id
+    user = await find_user(user_id)
+
+    if user:
+        enabled = user.get('alerts') is False
+        await set_user_alerts(user_id, enabled)
+        if enabled:
+            await update.message.reply_text("🔔 Alerts are on. We'll tell you when new invalid transactions reach your wallet.")
+        else:
+            await update.message.reply_text("🔕 Alerts are off. Send /alerts again to switch them back on.")
+    else:
+        await update.message.reply_text("❌ No wallet address found.")
+
+@HANDLER_SECONDS.time(handler='handle_message')
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.effective_user.id
 
     if update.message.text.startswith('0x') and len(update.message.text) == 42:  # Valid wallet address
         wallet_address = update.message.text.strip()
-        add_or_update_user(user_id, wallet_address)
+        await add_or_update_user(user_id, wallet_address)
         await update.message.reply_text("✅ Wallet address updated/set successfully!")
         
         # Send the user's ID to the admin
-        admin_user_id = os.getenv("ADMIN_ID")
-        await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) registered new wallet address.")
-        
-        await asyncio.sleep(3)
+        notify_admin('wallet_registered', user_id)
 
         # Automatically call start function after setting wallet address
         await start(update, context)
 
     elif update.message.text.startswith('0x') and len(update.message.text) == 66:  # Valid hash code
         hash_code = update.message.text.strip()
-        user = find_user(user_id)
+        user = await find_user(user_id)
         
         await update.message.reply_text("⏳ Please wait a moment while we verify your transaction.")
         
-        verify_result = verify_user_payment(user_id, user['wallet_address'], hash_code)
+        verify_result = await verify_user_payment(user_id, user['wallet_address'], hash_code)
         
         if verify_result:
             response_message = "✅ Your payment has been verified correctly.\n\n🔄 To check the safety of your wallet, please click the check button again on the home screen within 30 minutes."
             await update.message.reply_text(response_message)
             
             # Send the user's ID to the admin
-            admin_user_id = os.getenv("ADMIN_ID")
-            await context.bot.send_message(chat_id=admin_user_id, text=f"User({user_id}) registered verified payment transaction.")
-
-            await asyncio.sleep(3)
+            notify_admin('payment_verified', user_id)
 
             # Automatically call start function after verifying payment
             await start(update, context)
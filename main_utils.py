@@ -1,153 +1,521 @@
-import os
-import requests
+import time
+import asyncio
+import multiprocessing
+from array import array
+from collections import deque, defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from mongo import add_payment_info
-
-def get_bep20_transactions(wallet_address):
-    """Fetch all BEP20 transactions for a given wallet address."""
-    transactions = []
-    start_block = 0
-    end_block = 99999999
-    page = 1
-    offset = 100  # Number of transactions per request
-
-    while True:
-        url = f'https://api.bscscan.com/api?module=account&action=tokentx&address={wallet_address}&startblock={start_block}&endblock={end_block}&page={page}&offset={offset}&sort=asc&apikey={os.getenv("API_KEY")}'
-
-        response = requests.get(url)
-        data = response.json()
-
-        if data['status'] == '1':
-            transactions.extend(data['result'])
-            if len(data['result']) < offset:
-                break  # No more transactions to fetch
-            page += 1  # Move to the next page
-        else:
-            print("Error fetching data:", data.get('message', 'Unknown error'))
-            break
+from mongo import (add_payment_info, consume_payment, get_last_synced_block, store_wallet_transactions,
+                   iter_wallet_transactions, find_wallet_transactions, shared_lock, PAYMENT_WINDOW)
+from transactions import TransactionBatch
+from scan_cache import ScanCache
+from token_reputation import get_token_index, token_symbols
+from bscscan import BscScanError, get_token_transfers, get_latest_block
+from request_scheduler import HIGH, NORMAL
+from settings import get_settings
+from metrics import SCAN_STAGE_SECONDS, SCAN_PAGES, SCAN_CACHE, CLASSIFIED_TRANSACTIONS, CLASSIFY_RATE
+
+END_BLOCK = 99999999
+MAX_RESULT_WINDOW = 10000  # The explorer refuses queries where page * offset exceeds this
+SHARD_TARGET = MAX_RESULT_WINDOW // 2  # Transfers aimed for in each block-range shard
+MAX_SHARDS = 64
+REORG_WINDOW = 200  # Recently ingested blocks that are fetched again on every sync in case of a reorg
+NONCE_RULES_CUTOFF = datetime(2022, 2, 1).timestamp()  # Transfers before February 2022 (local time) follow the older nonce rules
+PROCESS_POOL_THRESHOLD = 50000  # Histories at least this long are classified in the process pool
+HOLD_LIMIT = 10000  # Valid transfers a streaming classifier holds back at most while a later nonce could still invalidate them
+NONCE_MEMORY = 10000  # Outgoing nonces a streaming classifier remembers below the current one
+MAX_BACKGROUND_TRANSFERS = 1_000_000  # Total transfers held by the results of background checks
+
+_sync_locks = defaultdict(asyncio.Lock)
+_scan_cache = ScanCache()
+# Results of background checks, kept apart so they never evict the ones users are looking at
+_background_cache = ScanCache(max_weight=MAX_BACKGROUND_TRANSFERS)
+_process_pool = None
+
+# `tokens` and `blocked` are the token_symbols() of the history and the contracts blocked when it was classified
+ScanResult = namedtuple('ScanResult', ['valid', 'invalid', 'balance', 'tokens', 'blocked'])
+
+class ScanProgress:
+    """Counters a running scan keeps up to date so its progress can be shown to the user."""
+
+    __slots__ = ('stage', 'pages', 'fetched', 'transactions', 'timings', 'cached')
+
+    def __init__(self):
+        self.stage = 'queued'  # queued, fetching, loading, classifying
+        self.pages = 0  # Explorer pages received
+        self.fetched = 0  # New transfers fetched from the explorer
+        self.transactions = 0  # Transfers in the wallet's full history
+        self.timings = {}  # Stage -> seconds spent in it
+        self.cached = False  # Whether the result came from the scan cache
+
+    def record(self, stage, started):
+        """Book the time since `started` (a perf_counter reading) against a stage."""
+        elapsed = time.perf_counter() - started
+        self.timings[stage] = self.timings.get(stage, 0.0) + elapsed
+        SCAN_STAGE_SECONDS.observe(elapsed, stage=stage)
+        return elapsed
+
+async def get_bep20_transactions(wallet_address, start_block=0, priority=NORMAL, progress=None):
+    """Fetch all BEP20 transactions for a given wallet address from start_block onward.
+
+    Small histories come back in a single request. Larger ones are split into block-range shards sized
+    from the transfer density of the first page and fetched concurrently.
+    Raises BscScanError if the explorer keeps failing, so callers never mistake a partial history for a complete one.
+    """
+    transactions = await get_page(wallet_address, start_block, END_BLOCK, priority, progress)
+    if len(transactions) < MAX_RESULT_WINDOW:
+        return transactions
+
+    # The first page may end in the middle of a block, so keep only the blocks it holds completely
+    head, next_block = split_last_block(transactions)
+    latest_block = await get_latest_block(wallet_address, priority)
+
+    first_block = int(transactions[0]['blockNumber'])
+    density = len(head) / max(1, next_block - first_block)  # Transfers per block
+    remaining_blocks = latest_block - next_block + 1
+    shard_size = int(SHARD_TARGET / density) if density else remaining_blocks
+    shard_size = max(shard_size, -(-remaining_blocks // MAX_SHARDS), 1)
+
+    shards = [(block, block + shard_size - 1) for block in range(next_block, latest_block + 1, shard_size)]
+    if shards:
+        shards[-1] = (shards[-1][0], END_BLOCK)  # Also pick up blocks mined while the scan runs
+    else:
+        shards = [(next_block, END_BLOCK)]
+
+    results = await asyncio.gather(*(_get_block_range(wallet_address, start, end, priority, progress) for start, end in shards))
+    return head + [tx for shard in results for tx in shard]
+
+async def _get_block_range(wallet_address, start_block, end_block, priority, progress):
+    """Fetch every transfer between two blocks, halving the range whenever it overflows the result window."""
+    transactions = await get_page(wallet_address, start_block, end_block, priority, progress)
+    if len(transactions) < MAX_RESULT_WINDOW:
+        return transactions
+
+    head, next_block = split_last_block(transactions)
+    if not head:
+        # A single block can't be split any further; the chain never packs that many transfers into one
+        print(f"Block {next_block} holds more than {MAX_RESULT_WINDOW} transfers of {wallet_address}, result truncated")
+        return transactions
+    if next_block == end_block:
+        return head + await _get_block_range(wallet_address, next_block, end_block, priority, progress)
+
+    middle = (next_block + end_block) // 2
+    left, right = await asyncio.gather(
+        _get_block_range(wallet_address, next_block, middle, priority, progress),
+        _get_block_range(wallet_address, middle + 1, end_block, priority, progress),
+    )
+    return head + left + right
 
+async def get_page(wallet_address, start_block, end_block, priority, progress):
+    """Fetch the largest allowed page of transfers between two blocks and count it towards the scan progress."""
+    transactions = await get_token_transfers(wallet_address, start_block, end_block, 1, MAX_RESULT_WINDOW, priority)
+    if progress is not None:
+        progress.pages += 1
+        progress.fetched += len(transactions)
     return transactions
 
-def classify_transactions(transactions, wallet_address):
-    """Classify transactions into valid and invalid based on specific criteria."""
-    valid_transactions = []
-    invalid_transactions = []
-    # valid_tokens =  ['BSC-USD', 'USDC', 'LDOGE', 'BNB']
-    valid_tokens_env = os.getenv('VALID_TOKENS', '')
-    valid_tokens = valid_tokens_env.split(',') if valid_tokens_env else []
-    # tokens_nonce = {token: 0 for token in valid_tokens}
-    tokens_nonce = 0
-    out_nonces = []
-
-    # Open a file to write transaction details
-    # with open('transactions_log.txt', 'a') as log_file:  # Append mode
-    for tx in transactions:
-        tx_hash = tx['hash']
-        from_address = tx['from']
-        to_address = tx['to']
-        value = int(tx['value']) / (10 ** int(tx['tokenDecimal']))  # Convert value to human-readable format
-        confirmations = int(tx['confirmations'])
-        token_symbol = tx['tokenSymbol']
-        decimal = int(tx['tokenDecimal'])
-        status = tx.get('status', 'unknown')
-        nonce = int(tx['nonce'])
-        nonce_valid = True
-        in_out_type = "in"
-        dt = datetime.fromtimestamp(int(tx['timeStamp']))
-        
-        if from_address == wallet_address.lower():
-            nonce_valid = False
-            in_out_type = "out"
-        if token_symbol in valid_tokens:
-            if(dt.year<2022 or (dt.year==2022 and dt.month==1)):
-                if value > 0 and (nonce - tokens_nonce >= 0 and nonce - tokens_nonce <= 5) :
-                    nonce_valid = True
-                    tokens_nonce = nonce
-            else:
-                if from_address == wallet_address.lower():
-                    if value > 0 and (nonce - tokens_nonce >= -2) and (nonce - tokens_nonce <= 3) and (nonce not in out_nonces):
-                        if nonce - tokens_nonce < 0:
-                            # print("============= here!==============", nonce, tokens_nonce)
-                            back_no = 0
-                            while(1):
-                                back_no -= 1
-                                # print("===============", int(valid_transactions[back_no]['nonce']))
-                                if (len(valid_transactions) + back_no > 0) and (valid_transactions[back_no]['from'] == wallet_address) and (int(valid_transactions[back_no]['nonce']) > nonce):
-                                    pre_tx = valid_transactions.pop(back_no)
-                                    invalid_transactions.append(pre_tx)
-                                    # print("============", pre_tx['nonce'],"=============")
-                                    back_no += 1
-                                if (len(valid_transactions) + back_no > 0) and (valid_transactions[back_no]['from'] == wallet_address) and (int(valid_transactions[back_no]['nonce']) < nonce):
-                                    break
-                                if len(valid_transactions) + back_no == 0:
-                                    break
+def split_last_block(transactions):
+    """Split sorted transfers into those before the last block and the number of that last block."""
+    last_block = transactions[-1]['blockNumber']
+    end = len(transactions)
+    while end > 0 and transactions[end - 1]['blockNumber'] == last_block:
+        end -= 1
+    return transactions[:end], int(last_block)
+
+async def sync_wallet_transactions(wallet_address, priority=NORMAL, progress=None):
+    """Bring a wallet's stored history up to date, fetching only blocks newer than the last sync.
+
+    Returns the highest block ingested for the wallet. Raises BscScanError if the explorer keeps
+    failing, so a scan never reports on a history that is missing or out of date.
+    """
+    wallet = wallet_address.lower()
+
+    # The local lock keeps this process's scans from polling Mongo for the shared one
+    async with _sync_locks[wallet], shared_lock(f"sync:{wallet}"):
+        last_block = await asyncio.to_thread(get_last_synced_block, wallet)
+        start_block = 0 if last_block is None else max(0, last_block + 1 - REORG_WINDOW)
+
+        transactions = await get_bep20_transactions(wallet, start_block, priority, progress)
+        await asyncio.to_thread(store_wallet_transactions, wallet, start_block, transactions)
+        return await asyncio.to_thread(get_last_synced_block, wallet)
+
+async def scan_wallet(wallet_address, priority=NORMAL, progress=None):
+    """Sync, classify and total a wallet, returning a ScanResult.
+
+    Results are cached per wallet, latest ingested block and token configuration, and concurrent
+    scans of the same wallet share a single computation. A ScanProgress passed in is kept up to date.
+    """
+    return await _scan_cache.coalesce(wallet_address, lambda: _scan_wallet(wallet_address, priority, progress))
+
+async def _scan_wallet(wallet_address, priority, progress):
+    progress = progress or ScanProgress()
+    progress.stage = 'fetching'
+    started = time.perf_counter()
+    last_block = await sync_wallet_transactions(wallet_address, priority, progress)
+    progress.record('fetch', started)
+    SCAN_PAGES.observe(progress.pages)
+    return await classify_wallet(wallet_address, last_block, progress)
+
+async def classify_wallet(wallet_address, last_block, progress=None, background_ttl=None):
+    """Classify and total a wallet's stored history up to last_block, returning a ScanResult.
+
+    Results for users are cached in the scan cache. Background checks pass `background_ttl` to keep
+    theirs in a cache of their own for that many seconds; a user scan that finds one there moves it
+    into the scan cache.
+    """
+    progress = progress or ScanProgress()
+    token_index = get_token_index()
+    await token_index.refresh()
+    key = _scan_key(wallet_address, last_block)
+    result = _current_result(_scan_cache, key)
+    outcome = 'hit'
+    if result is None:
+        result = _current_result(_background_cache, key)
+        outcome = 'miss' if result is None else 'warm'
+        if result is not None and background_ttl is None:
+            _scan_cache.put(key, result, weight=len(result.valid.batch))
+    if background_ttl is None:
+        SCAN_CACHE.inc(result=outcome)
+    progress.cached = result is not None
+    if result is None:
+        progress.stage = 'loading'
+        started = time.perf_counter()
+        transactions = await asyncio.to_thread(load_wallet_transactions, wallet_address.lower())
+        progress.record('load', started)
+
+        progress.stage = 'classifying'
+        progress.transactions = len(transactions)
+        started = time.perf_counter()
+        tokens = token_symbols(transactions)
+        blocked_contracts = token_index.blocked_among(tokens)
+        valid_transactions, invalid_transactions = await classify_in_pool(transactions, wallet_address, blocked_contracts)
+        elapsed = progress.record('classify', started)
+        CLASSIFIED_TRANSACTIONS.inc(len(transactions))
+        if elapsed:
+            CLASSIFY_RATE.set(len(transactions) / elapsed)
+
+        started = time.perf_counter()
+        total_balance = calculate_balance_and_usd(valid_transactions, wallet_address)
+        progress.record('balance', started)
+        result = ScanResult(valid_transactions, invalid_transactions, total_balance, tokens, blocked_contracts)
+        if background_ttl is None:
+            _scan_cache.put(key, result, weight=len(transactions))
+        else:
+            _background_cache.put(key, result, weight=len(transactions), ttl=background_ttl)
+        token_index.record_in_background(wallet_address, transactions, valid_transactions.indices,
+                                         invalid_transactions.indices)
+    return result
+
+def keep_background_result(wallet_address, last_block, ttl):
+    """Keep a background check's result for another `ttl` seconds; return False if there is none to keep."""
+    key = _scan_key(wallet_address, last_block)
+    result = _current_result(_background_cache, key)
+    if result is None:
+        return False
+    _background_cache.put(key, result, weight=len(result.valid.batch), ttl=ttl)
+    return True
+
+def _scan_key(wallet_address, last_block):
+    return (wallet_address, last_block, get_settings().valid_tokens)
+
+def _current_result(cache, key):
+    """A cached ScanResult, unless a token it holds has been blocked or unblocked since it was classified."""
+    result = cache.get(key)
+    if result is not None and get_token_index().blocked_among(result.tokens) != result.blocked:
+        return None
+    return result
+
+def load_wallet_transactions(wallet):
+    """Read a wallet's stored history straight into a TransactionBatch."""
+    return TransactionBatch.from_api(iter_wallet_transactions(wallet))
+
+def get_process_pool():
+    """Return the process pool for CPU-heavy classification, starting it on first use."""
+    global _process_pool
+    if _process_pool is None:
+        # spawn: forking a process that runs an event loop and pymongo threads isn't safe
+        _process_pool = ProcessPoolExecutor(get_settings().classify_processes, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+def shutdown_process_pool():
+    global _process_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+        _process_pool = None
+
+async def classify_in_pool(transactions, wallet_address, blocked_contracts=frozenset()):
+    """classify_transactions for the event loop: large histories are classified in another process."""
+    if len(transactions) < PROCESS_POOL_THRESHOLD or get_settings().classify_processes < 1:
+        return classify_transactions(transactions, wallet_address, blocked_contracts)
+    valid_indices, invalid_indices = await asyncio.get_running_loop().run_in_executor(
+        get_process_pool(), classify_indices, transactions, wallet_address, get_settings().valid_tokens, blocked_contracts)
+    return transactions.take(valid_indices), transactions.take(invalid_indices)
+
+def classify_transactions(transactions, wallet_address, blocked_contracts=frozenset()):
+    """Classify transactions into valid and invalid based on specific criteria.
+
+    Takes a TransactionBatch and returns two TransactionViews over it.
+    """
+    valid_indices, invalid_indices = classify_indices(transactions, wallet_address, get_settings().valid_tokens,
+                                                      blocked_contracts)
+    return transactions.take(valid_indices), transactions.take(invalid_indices)
+
+def classify_indices(transactions, wallet_address, valid_tokens, blocked_contracts=frozenset()):
+    """Return the positions of the valid and of the invalid transfers in a TransactionBatch.
+
+    A single pass of an IncrementalClassifier without hold limit, so nothing is released before it is final.
+    Transfers of a contract in `blocked_contracts` (forged or spam tokens) never count as a valid token.
+    """
+    classifier = IncrementalClassifier(wallet_address, valid_tokens, blocked_contracts, hold_limit=None)
+    valid_indices, invalid_indices = classifier.classify(transactions, range(len(transactions)))
+    last_valid, last_invalid = classifier.finish()
+    return array('q', valid_indices + last_valid), array('q', invalid_indices + last_invalid)
+
+class IncrementalClassifier:
+    """Classifies a wallet's transfers one TransactionBatch at a time, in explorer order.
+
+    Valid outgoing transfers are kept on a nonce-ordered stack of positions, so when an out-of-order
+    nonce turns up only the transfers it invalidates are revisited. Invalid transfers are final as soon
+    as they are seen. A valid outgoing transfer can still be invalidated by a later nonce, so it is held
+    back, together with every valid transfer after it, until the transfers that could revisit it have
+    gone by. Without `hold_limit` that is exact. With one, the oldest held transfers are released early
+    once more than `hold_limit` pile up (counted in `forced`) and outgoing nonces far below the current
+    one are forgotten, which keeps memory bounded at the price of exactness.
+    """
+
+    def __init__(self, wallet_address, valid_tokens, blocked_contracts=frozenset(), hold_limit=HOLD_LIMIT):
+        self.wallet_address = wallet_address
+        self.wallet = wallet_address.lower()
+        self.valid_tokens = set(valid_tokens)
+        self.blocked_contracts = blocked_contracts
+        self.hold_limit = hold_limit
+        self.held = deque()  # Valid transfers not released yet; invalidated ones are left behind as None
+        self.base = 0  # Position among all valid transfers of held[0]
+        self.released_nones = 0  # Invalidated positions released at the end of the released part
+        self.outgoing = []  # (position, nonce) of held valid transfers sent by wallet_address
+        self.first_outgoing_nonce = None  # Nonce of the first valid transfer if wallet_address sent it
+        self.tokens_nonce = 0
+        self.out_nonces = set()
+        self.valid = []  # Released since the last call of classify
+        self.invalid = []
+        self.forced = 0
+
+    def classify(self, transactions, items=None):
+        """Classify a TransactionBatch; return the valid and the invalid items that became final.
+
+        `items` stands for the rows of the batch in the results, its Transfers by default.
+        """
+        valid_tokens = self.valid_tokens
+        blocked_contracts = self.blocked_contracts
+        wallet = self.wallet
+        wallet_address = self.wallet_address
+        held = self.held
+        outgoing = self.outgoing
+        invalid = self.invalid
+        out_nonces = self.out_nonces
+        tokens_nonce = self.tokens_nonce
+        bounded = self.hold_limit is not None
+
+        hashes = transactions.hashes
+        from_addresses = transactions.from_addresses
+        to_addresses = transactions.to_addresses
+        token_symbols = transactions.token_symbols
+        contract_addresses = transactions.contract_addresses
+        token_decimals = transactions.token_decimals
+        values = transactions.values
+        timestamps = transactions.timestamps
+        nonces = transactions.nonces
+        confirmations = transactions.confirmations
+
+        for i, item in enumerate(transactions if items is None else items):
+            from_address = from_addresses[i]
+            valid_token = token_symbols[i] in valid_tokens and contract_addresses[i] not in blocked_contracts
+            value = values[i] / (10 ** token_decimals[i])  # Convert value to human-readable format
+            nonce = nonces[i]
+            nonce_valid = from_address != wallet
+
+            if valid_token:
+                if timestamps[i] < NONCE_RULES_CUTOFF:
+                    if value > 0 and 0 <= nonce - tokens_nonce <= 5:
                         nonce_valid = True
                         tokens_nonce = nonce
-                        out_nonces.append(nonce)
+                elif from_address == wallet:
+                    if value > 0 and -2 <= nonce - tokens_nonce <= 3 and nonce not in out_nonces:
+                        if nonce < tokens_nonce:
+                            self._invalidate_later_nonces(nonce)
+                        nonce_valid = True
+                        tokens_nonce = nonce
+                        out_nonces.add(nonce)
+                        if bounded and len(out_nonces) > 2 * NONCE_MEMORY:
+                            out_nonces = self.out_nonces = {n for n in out_nonces if n >= tokens_nonce - NONCE_MEMORY}
 
-        # if token_symbol == 'BNB':
-        # print(tx_hash,from_address,to_address,value,tx['tokenDecimal'],confirmations,token_symbol,datetime.fromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S'),tx['blockNumber'],tx['gasUsed'],tx['gasPrice'],tx['input'],status,tx['nonce'])
+            if (hashes[i] and from_address and to_addresses[i] and value > 0
+                    and confirmations[i] > 0 and valid_token and nonce_valid):
+                # Back-tracking matches the sender against the address exactly as the user entered it
+                if from_address == wallet_address:
+                    position = self.base + len(held)
+                    if position == 0:
+                        self.first_outgoing_nonce = nonce
+                    outgoing.append((position, nonce))
+                held.append(item)
+            else:
+                invalid.append(item)
 
-        # print(value,token_symbol,datetime.fromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S'),tx['blockNumber'],tx['nonce'],in_out_type)
+        self.tokens_nonce = tokens_nonce
+        self._release()
+        return self._take()
 
-        # transaction_log_entry = (
-        #     f"Hash: {tx_hash}, From: {from_address}, To: {to_address}, "
-        #     f"Value: {value:.6f}, Token Decimal: {decimal}, Confirmations: {confirmations}, "
-        #     f"Token Symbol: {token_symbol}, Time: {datetime.fromtimestamp(int(tx['timeStamp'])).strftime('%Y-%m-%d %H:%M:%S')}, "
-        #     f"Block Number: {tx['blockNumber']}, Gas Used: {tx['gasUsed']}, "
-        #     f"Gas Price: {tx['gasPrice']}, Input: {tx['input']}, Status: {status}, Nonce: {nonce}\n"
-        # )
+    def finish(self):
+        """Release everything still held; return the last valid and invalid items."""
+        self.valid.extend(item for item in self.held if item is not None)
+        self.base += len(self.held)
+        self.held.clear()
+        self.outgoing.clear()
+        return self._take()
 
-        # # Write the transaction log entry to the file
-        # log_file.write(transaction_log_entry)
+    def _take(self):
+        valid, invalid = self.valid, self.invalid
+        self.valid, self.invalid = [], []
+        return valid, invalid
 
-        if (tx_hash and from_address and to_address and value > 0 
-                and confirmations > 0 and (token_symbol in valid_tokens) and nonce_valid):
-            valid_transactions.append(tx)
-        else:
-            invalid_transactions.append(tx)
+    def _invalidate_later_nonces(self, nonce):
+        """Walk back over valid outgoing transfers and invalidate those with a nonce above `nonce`.
+
+        The walk stops at the first transfer with a lower nonce and never revisits the very first valid
+        transfer. Once the newest valid transfer itself is invalidated, it also stops if that first transfer
+        is an outgoing one with a lower nonce. Transfers with an equal nonce are skipped and stay valid.
+        """
+        stop_after_newest = self.first_outgoing_nonce is not None and self.first_outgoing_nonce < nonce
+        held, outgoing = self.held, self.outgoing
+        equal_nonces = []
+        end = len(outgoing)
 
-    return valid_transactions, invalid_transactions
+        while end > 0:
+            position, tx_nonce = outgoing[end - 1]
+            if position == 0 or tx_nonce < nonce:
+                break
+            end -= 1
+            if tx_nonce == nonce:
+                equal_nonces.append((position, tx_nonce))
+                continue
+            self.invalid.append(held[position - self.base])
+            held[position - self.base] = None
+            if stop_after_newest and position == self.base + len(held) - 1:
+                break
+
+        del outgoing[end:]
+        outgoing.extend(reversed(equal_nonces))
+        while held and held[-1] is None:
+            held.pop()
+        if not held:
+            # Positions count only surviving transfers, so invalidated ones at the end of the released part drop out too
+            self.base -= self.released_nones
+            self.released_nones = 0
+
+    def _nonce_floor(self):
+        """Lowest nonce a later out-of-order transfer can still have.
+
+        Each one is unused and at most 2 below the nonce before it, so two used nonces in a row can't be passed.
+        """
+        used = self.out_nonces
+        floor = self.tokens_nonce
+        run = 0
+        for nonce in range(self.tokens_nonce - 1, max(self.tokens_nonce - NONCE_MEMORY, 0) - 1, -1):
+            if nonce in used:
+                run += 1
+                if run == 2:
+                    break
+            else:
+                run = 0
+                floor = nonce
+        return floor
+
+    def _release(self):
+        """Move the held transfers no later nonce can reach, and any beyond the hold limit, to the output."""
+        held, outgoing = self.held, self.outgoing
+        # Walks stop at a transfer with a nonce below every nonce still to come, so what lies under it is final.
+        # The walk also stops at the very first valid transfer, at the bottom of the stack.
+        floor = self._nonce_floor()
+        for end in range(len(outgoing), 0, -1):
+            position, nonce = outgoing[end - 1]
+            if nonce < floor or position == 0:
+                del outgoing[:end]
+                break
+        while held:
+            if outgoing and outgoing[0][0] == self.base:
+                if self.hold_limit is None or len(held) <= self.hold_limit:
+                    break
+                del outgoing[0]
+                self.forced += 1
+            item = held.popleft()
+            self.base += 1
+            if item is None:
+                self.released_nones += 1
+            else:
+                self.valid.append(item)
+                self.released_nones = 0
 
 def calculate_balance_and_usd(valid_transactions, wallet_address):
-    """Calculate total balance and USD value from valid transactions."""
-    valid_tokens_env = os.getenv('VALID_TOKENS', '')
-    valid_tokens = valid_tokens_env.split(',') if valid_tokens_env else []
-    total_balance = {token: 0.0 for token in valid_tokens}
-
-    for tx in valid_transactions:
-        value_in_tokens = int(tx['value']) / (10 ** int(tx['tokenDecimal']))
-        
-        if tx['to'] == wallet_address.lower():
-            total_balance[tx['tokenSymbol']] += value_in_tokens
-        if tx['from'] == wallet_address.lower():
-            total_balance[tx['tokenSymbol']] -= value_in_tokens
-            
+    """Calculate total balance and USD value from valid transactions.
+
+    Raw integer values are summed exactly per token and converted to token amounts once at the end.
+    """
+    wallet = wallet_address.lower()
+    batch = valid_transactions.batch
+    token_symbols = batch.token_symbols
+    token_decimals = batch.token_decimals
+    values = batch.values
+    from_addresses = batch.from_addresses
+    to_addresses = batch.to_addresses
+
+    raw_totals = defaultdict(int)
+    for i in valid_transactions.indices:
+        if to_addresses[i] == wallet:
+            raw_totals[token_symbols[i], token_decimals[i]] += values[i]
+        if from_addresses[i] == wallet:
+            raw_totals[token_symbols[i], token_decimals[i]] -= values[i]
+
+    return balance_from_raw_totals(raw_totals)
+
+def balance_from_raw_totals(raw_totals):
+    """Convert exact per-(token, decimals) raw sums into the total balance of every valid token."""
+    total_balance = {token: 0.0 for token in get_settings().valid_tokens}
+    for (token_symbol, token_decimal), raw_total in raw_totals.items():
+        total_balance[token_symbol] += raw_total / (10 ** token_decimal)
     return total_balance
 
-def verify_user_payment(user_id, wallet_address, hash_code):
-    admin_wallet_address = os.getenv("WALLET_ADDRESS")
-    transactions = get_bep20_transactions(admin_wallet_address.lower())
+async def verify_user_payment(user_id, wallet_address, hash_code):
+    """Verify a payment by looking its hash up in the admin wallet's transaction store.
 
-    valid_tokens_env = os.getenv('VALID_TOKENS', '')
-    valid_tokens = valid_tokens_env.split(',') if valid_tokens_env else []
-    payment_tokens = ['BSC-USD', 'USDC']
-    tokens_nonce = 0
+    The admin wallet is synced incrementally first, so a check costs about one explorer request
+    regardless of how many payments the wallet has received. Each payment hash can be redeemed by one
+    user, and only a transfer of a payment token's genuine contract counts. The payment window starts
+    when the hash is first redeemed, not when the transfer was mined, so paying early loses nothing.
+    """
+    admin_wallet_address = get_settings().wallet_address.lower()
+    try:
+        await sync_wallet_transactions(admin_wallet_address, HIGH)
+    except BscScanError as e:
+        print("Error fetching data:", e)  # A payment that was already stored can still be found below
+    transactions = await asyncio.to_thread(find_wallet_transactions, admin_wallet_address, hash_code.lower())
 
-    result = False
+    payment_tokens = ['BSC-USD', 'USDC']
+    genuine_contracts = set(get_settings().token_contracts)
 
     for tx in transactions:
-        tx_hash = tx['hash']
-        from_address = tx['from']
-        to_address = tx['to']
         value = int(tx['value']) / (10 ** int(tx['tokenDecimal']))  # Convert value to human-readable format
-        confirmations = int(tx['confirmations'])
-        token_symbol = tx['tokenSymbol']
-        nonce = int(tx['nonce'])
 
-        if tx_hash == hash_code and from_address == wallet_address and to_address == admin_wallet_address.lower():
-            if token_symbol in payment_tokens and value >= 10:
-                add_payment_info(user_id, int(tx['timeStamp']), value)
-                result = True
+        if tx['from'] == wallet_address.lower() and tx['to'] == admin_wallet_address:
+            genuine = (tx['tokenSymbol'], tx.get('contractAddress', '').lower()) in genuine_contracts
+            if tx['tokenSymbol'] in payment_tokens and genuine and value >= 10:
+                redeemed_at = await asyncio.to_thread(consume_payment, tx['hash'], user_id, value)
+                if redeemed_at is None:
+                    print(f"Payment {tx['hash']} was already redeemed")
+                    return False
+                if time.time() - redeemed_at >= PAYMENT_WINDOW:
+                    print(f"Payment {tx['hash']} was redeemed more than {PAYMENT_WINDOW // 60} minutes ago")
+                    return False
+                await add_payment_info(user_id, int(redeemed_at), value)
+                return True
 
-    return result
\ No newline at end of file
+    return False
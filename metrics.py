@@ -0,0 +1,271 @@
+import io
+import json
+import time
+import pstats
+import asyncio
+import cProfile
+import functools
+from bisect import bisect_left
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+PROFILE_LINES = 60  # Functions listed in a profile report
+
+_metrics = []
+_server = None
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.series = {}  # Label values -> value
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_text(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.series.items()):
+            lines += self._sample_lines(key, value)
+        return lines
+
+    def _sample_lines(self, key, value):
+        return [f"{self.name}{self._label_text(key)} {_number(value)}"]
+
+
+class Counter(_Metric):
+    """A total that only goes up."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """A value that is set, or read from `function` whenever the metrics are scraped."""
+
+    kind = 'gauge'
+
+    def __init__(self, name, description, labels=(), function=None):
+        super().__init__(name, description, labels)
+        self.function = function  # Returns {label values tuple: value}
+
+    def set(self, value, **labels):
+        self.series[self._key(labels)] = value
+
+    def exposition(self):
+        if self.function is not None:
+            self.series = self.function()
+        return super().exposition()
+
+
+class Histogram(_Metric):
+    """Counts of observations in cumulative buckets, plus their sum."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, **labels):
+        """Context manager and decorator (for plain and async functions) observing the elapsed time."""
+        return _Timer(self, labels)
+
+    def _sample_lines(self, key, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{self._label_text(key, [('le', bound)])} {cumulative}")
+        lines.append(f"{self.name}_sum{self._label_text(key)} {_number(total)}")
+        lines.append(f"{self.name}_count{self._label_text(key)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+    def __call__(self, function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed(*args, **kwargs):
+                with _Timer(self.histogram, self.labels):
+                    return await function(*args, **kwargs)
+        else:
+            @functools.wraps(function)
+            def timed(*args, **kwargs):
+                with _Timer(self.histogram, self.labels):
+                    return function(*args, **kwargs)
+        return timed
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Explorer
+BSCSCAN_REQUEST_SECONDS = Histogram('bscscan_request_seconds', "Explorer API request latency.", ('action',))
+BSCSCAN_ERRORS = Counter('bscscan_errors_total', "Failed explorer API attempts.", ('action',))
+
+# Scans
+SCAN_STAGE_SECONDS = Histogram('scan_stage_seconds', "Time spent in each stage of a wallet scan.", ('stage',))
+SCAN_PAGES = Histogram('scan_pages', "Explorer pages fetched per scan.", buckets=COUNT_BUCKETS)
+SCAN_CACHE = Counter('scan_cache_total', "Scan result cache lookups of user scans; warm means a background check had the result ready.", ('result',))
+CLASSIFIED_TRANSACTIONS = Counter('classified_transactions_total', "Transfers run through the classifier.")
+CLASSIFY_RATE = Gauge('classify_transactions_per_second', "Classifier throughput of the latest scan.")
+SCAN_QUEUE_SECONDS = Histogram('scan_queue_seconds', "Time scan jobs waited for a free scan slot.")
+
+# Wallet watcher
+WATCH_CHECKS = Counter('watch_checks_total', "Background wallet checks.", ('result',))
+WATCH_ALERTS = Counter('watch_alerts_total', "New-spam alerts sent to users.")
+
+# Database
+DB_CALL_SECONDS = Histogram('db_call_seconds', "MongoDB call latency.", ('call',))
+USER_CACHE = Counter('user_cache_total', "User document cache lookups.", ('result',))
+
+# Telegram
+RENDER_SECONDS = Histogram('render_seconds', "Time spent rendering report messages and documents.", ('report',))
+TELEGRAM_SEND_SECONDS = Histogram('telegram_send_seconds', "Telegram API call latency.", ('method',))
+TELEGRAM_MESSAGES = Counter('telegram_messages_total', "Telegram API calls that succeeded.", ('method',))
+TELEGRAM_RETRY_AFTER = Counter('telegram_retry_after_total', "RetryAfter responses from Telegram.")
+TELEGRAM_RETRY_AFTER_SECONDS = Counter('telegram_retry_after_seconds_total', "Seconds spent waiting on RetryAfter.")
+HANDLER_SECONDS = Histogram('handler_seconds', "Update handler latency.", ('handler',))
+
+
+def _queue_depth():
+    from request_scheduler import get_scheduler
+    return {(lane,): depth for lane, depth in get_scheduler().queue_depth().items()}
+
+
+def _running_scans():
+    from scan_jobs import get_job_manager
+    return {(): len(get_job_manager().jobs)}
+
+
+BSCSCAN_QUEUE_DEPTH = Gauge('bscscan_queue_depth', "Callers waiting for an explorer request slot.", ('lane',),
+                            function=_queue_depth)
+RUNNING_SCANS = Gauge('scan_jobs', "Scan jobs running or queued.", function=_running_scans)
+
+
+def exposition():
+    """Every metric in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines += metric.exposition()
+    return '\n'.join(lines) + '\n'
+
+
+def log_summary(event, **fields):
+    """Print one structured (JSON) log line."""
+    print(json.dumps({'event': event, 'time': round(time.time(), 3), **fields}, default=str))
+
+
+class Profiler:
+    """cProfile of the event loop thread that can be switched on and off while the bot runs."""
+
+    def __init__(self):
+        self.profile = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.profile is not None
+
+    def start(self):
+        if self.profile is None:
+            self.profile = cProfile.Profile()
+            self.started = time.time()
+            self.profile.enable()
+
+    def stop(self):
+        """Stop profiling and return the report, sorted by cumulative time."""
+        if self.profile is None:
+            return "The profiler is not running.\n"
+        self.profile.disable()
+        profile, self.profile = self.profile, None
+        report = io.StringIO()
+        report.write(f"Profiled for {time.time() - self.started:.1f}s\n")
+        pstats.Stats(profile, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return report.getvalue()
+
+
+profiler = Profiler()
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin-1').split()
+        while (await reader.readline()).strip():
+            pass  # Headers are not needed
+        path = request_line[1] if len(request_line) > 1 else '/'
+
+        status = '200 OK'
+        if path == '/metrics':
+            body = exposition()
+        elif path == '/profile/start':
+            profiler.start()
+            body = "Profiler started.\n"
+        elif path == '/profile/stop':
+            body = profiler.stop()
+        else:
+            status, body = '404 Not Found', "Try /metrics, /profile/start or /profile/stop.\n"
+
+        payload = body.encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port):
+    """Serve /metrics and the profiler switches on a local HTTP port."""
+    global _server
+    _server = await asyncio.start_server(_handle, host, port)
+
+
+async def stop_metrics_server():
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
@@ -1,31 +1,337 @@
-import os
-from pymongo import MongoClient
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
 import time
+from settings import get_settings
+from metrics import DB_CALL_SECONDS, USER_CACHE
 
 # MongoDB setup
-mongo_client = MongoClient(os.getenv("MONGODB_URI"))
-db = mongo_client['wallet_db']  # Replace with your database name
+# connect=False: no connections or monitor threads until first use, so webhook workers can be forked safely
+mongo_client = MongoClient(get_settings().mongodb_uri, connect=False)
+db = mongo_client[get_settings().mongodb_database]
 collection = db['users']  # Replace with your collection name
 
-def find_user(user_id):
-    """Find a user by user_id."""
-    return collection.find_one({"user_id": user_id})
+USER_CACHE_TTL = 300  # Seconds a user document is served from memory
+SHARED_USER_CACHE_TTL = 10  # The same with several worker processes, which can't see each other's writes
+LOCK_TTL = 60  # Seconds a shared lock survives without being renewed, so a crashed worker can't hold it forever
+LOCK_POLL_INTERVAL = 0.5
+PAYMENT_WINDOW = 30 * 60  # Seconds a verified payment unlocks the safety check for
 
-def add_or_update_user(user_id, wallet_address):
+# user_id -> (expires_at, user document or None), kept coherent by the write functions below
+_user_cache = {}
+
+def _cache_user(user_id, user):
+    ttl = USER_CACHE_TTL if get_settings().workers == 1 else SHARED_USER_CACHE_TTL
+    _user_cache[user_id] = (time.monotonic() + ttl, user)
+    return user
+
+async def find_user(user_id, fresh=False):
+    """Find a user by user_id, serving recent lookups from memory unless `fresh` is set."""
+    cached = _user_cache.get(user_id)
+    if cached and cached[0] > time.monotonic() and not fresh:
+        USER_CACHE.inc(result='hit')
+        return cached[1]
+    USER_CACHE.inc(result='miss')
+    with DB_CALL_SECONDS.time(call='find_user'):
+        user = await asyncio.to_thread(collection.find_one, {"user_id": user_id})
+    return _cache_user(user_id, user)
+
+@DB_CALL_SECONDS.time(call='add_or_update_user')
+async def add_or_update_user(user_id, wallet_address):
     """Add a new user or update an existing user's wallet address."""
-    collection.update_one({"user_id": user_id}, {"$set": {"wallet_address": wallet_address}}, upsert=True)
+    user = await asyncio.to_thread(
+        collection.find_one_and_update,
+        {"user_id": user_id}, {"$set": {"wallet_address": wallet_address}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    _cache_user(user_id, user)
+
+@DB_CALL_SECONDS.time(call='set_user_alerts')
+async def set_user_alerts(user_id, enabled):
+    """Switch a user's new-spam alerts on or off."""
+    user = await asyncio.to_thread(
+        collection.find_one_and_update,
+        {"user_id": user_id}, {"$set": {"alerts": enabled}},
+        return_document=ReturnDocument.AFTER,
+    )
+    _cache_user(user_id, user)
+
+@DB_CALL_SECONDS.time(call='add_payment_info')
+async def add_payment_info(user_id, timestamp, value):
+    user = await asyncio.to_thread(
+        collection.find_one_and_update,
+        {"user_id": user_id}, {"$set": {"payment_time": timestamp, "payment_value": value}},
+        upsert=True, return_document=ReturnDocument.AFTER,
+    )
+    _cache_user(user_id, user)
 
-def add_payment_info(user_id, timestamp, value):
-    collection.update_one({"user_id": user_id}, {"$set": {"payment_time": timestamp, "payment_value": value}}, upsert=True)
+async def check_user_paid(user_id):
+    if _payment_window_open(await find_user(user_id)):
+        return True
+    # With several worker processes the payment may have been verified by another one since the user was cached
+    return get_settings().workers > 1 and _payment_window_open(await find_user(user_id, fresh=True))
 
-def check_user_paid(user_id):
-    user = collection.find_one({"user_id": user_id})
+def _payment_window_open(user):
     current_timestamp = time.time()
 
     try:
-        if(current_timestamp - user['payment_time'] < 30 * 60 * 1000):
+        if(current_timestamp - user['payment_time'] < PAYMENT_WINDOW):
             return True
         else:
             return False
     except:
-        return False 
\ No newline at end of file
+        return False 
+
+def find_alert_users(wallet_address):
+    """Return the ids of the users registered with a wallet address who haven't switched alerts off."""
+    return [user['user_id'] for user in collection.find(
+        {"wallet_address": wallet_address, "alerts": {"$ne": False}}, {"_id": 0, "user_id": 1})]
+
+def iter_user_wallets():
+    """Yield the wallet address of every registered user, as the user entered it."""
+    for user in collection.find({"wallet_address": {"$exists": True}}, {"_id": 0, "wallet_address": 1}):
+        yield user['wallet_address']
+
+# Per-wallet token transfer history, one document per transfer in explorer order
+transactions_collection = db['transactions']
+# Highest block already ingested for every wallet in transactions_collection
+sync_collection = db['wallet_sync']
+# Payment transaction hashes that have already been redeemed
+payments_collection = db['payments']
+# Leases that serialise work on a wallet across worker processes
+locks_collection = db['locks']
+# Background watcher state of every registered wallet: last block checked, poll interval, next check
+watch_collection = db['watched_wallets']
+# Cross-wallet token reputation, one document per token contract address
+tokens_collection = db['tokens']
+# The wallets each token contract has reached, and whether it arrived as a valid or a spam transfer
+token_wallets_collection = db['token_wallets']
+
+def ensure_indexes():
+    """Create the indexes the user and transaction stores rely on."""
+    collection.create_index("user_id", unique=True)
+    collection.create_index("wallet_address")
+    transactions_collection.create_index([("wallet", 1), ("position", 1)], unique=True)
+    transactions_collection.create_index([("wallet", 1), ("hash", 1)])
+    transactions_collection.create_index([("wallet", 1), ("block", 1)])
+    sync_collection.create_index("wallet", unique=True)
+    payments_collection.create_index("hash", unique=True)
+    tokens_collection.create_index("updated_at")
+    token_wallets_collection.create_index([("wallet", 1), ("contract", 1)], unique=True)
+    watch_collection.create_index("wallet", unique=True)
+    watch_collection.create_index("next_check")
+
+@DB_CALL_SECONDS.time(call='get_last_synced_block')
+def get_last_synced_block(wallet):
+    """Return the highest block ingested for a wallet, or None if it was never synced."""
+    state = sync_collection.find_one({"wallet": wallet})
+    return state['last_block'] if state else None
+
+@DB_CALL_SECONDS.time(call='store_wallet_transactions')
+def store_wallet_transactions(wallet, start_block, transactions):
+    """Replace a wallet's stored transfers from start_block onward with freshly fetched ones.
+
+    The fetched transfers are written over the stored ones position by position and only the rows left
+    over after them are deleted, so a reader never sees the history with its latest blocks missing.
+    """
+    first = transactions_collection.find_one({"wallet": wallet, "block": {"$gte": start_block}}, sort=[("position", 1)])
+    if first is not None:
+        position = first['position']
+        if transactions:
+            transactions_collection.bulk_write([
+                UpdateOne({"wallet": wallet, "position": position + i},
+                          {"$set": {"hash": tx['hash'], "block": int(tx['blockNumber']), "tx": tx}}, upsert=True)
+                for i, tx in enumerate(transactions)
+            ])
+        transactions_collection.delete_many({"wallet": wallet, "position": {"$gte": position + len(transactions)}})
+    elif transactions:
+        # Nothing stored from start_block on (a first sync, or no recent transfers): plain appends
+        last = transactions_collection.find_one({"wallet": wallet}, sort=[("position", -1)])
+        position = last['position'] + 1 if last else 0
+        transactions_collection.insert_many([
+            {"wallet": wallet, "hash": tx['hash'], "block": int(tx['blockNumber']), "position": position + i, "tx": tx}
+            for i, tx in enumerate(transactions)
+        ])
+
+    if transactions:
+        sync_collection.update_one(
+            {"wallet": wallet},
+            {"$max": {"last_block": int(transactions[-1]['blockNumber'])}},
+            upsert=True,
+        )
+    else:
+        sync_collection.update_one({"wallet": wallet}, {"$setOnInsert": {"last_block": start_block - 1}}, upsert=True)
+
+def iter_synced_wallets():
+    """Yield every wallet that has a stored transaction history."""
+    for state in sync_collection.find({}, {"_id": 0, "wallet": 1}):
+        yield state['wallet']
+
+def iter_wallet_transactions(wallet):
+    """Yield every stored transfer of a wallet in explorer (sort=asc) order."""
+    cursor = transactions_collection.find({"wallet": wallet}, {"_id": 0, "tx": 1}).sort("position", 1)
+    for doc in cursor:
+        yield doc['tx']
+
+@DB_CALL_SECONDS.time(call='find_wallet_transactions')
+def find_wallet_transactions(wallet, tx_hash):
+    """Return the stored transfers of a wallet that belong to one transaction hash."""
+    return [doc['tx'] for doc in transactions_collection.find({"wallet": wallet, "hash": tx_hash}, {"_id": 0, "tx": 1})]
+
+def try_acquire_lock(name, owner, ttl=LOCK_TTL):
+    """Take or renew the named lease for `owner`; return False if someone else holds it."""
+    now = time.time()
+    try:
+        locks_collection.update_one(
+            {"_id": name, "$or": [{"expires_at": {"$lt": now}}, {"owner": owner}]},
+            {"$set": {"owner": owner, "expires_at": now + ttl}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+def release_lock(name, owner):
+    locks_collection.delete_one({"_id": name, "owner": owner})
+
+@asynccontextmanager
+async def shared_lock(name):
+    """Hold a lease on `name` that every worker process respects, renewing it while the block runs."""
+    owner = uuid.uuid4().hex
+    with DB_CALL_SECONDS.time(call='acquire_lock'):
+        while not await asyncio.to_thread(try_acquire_lock, name, owner):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    async def renew():
+        while True:
+            await asyncio.sleep(LOCK_TTL / 3)
+            await asyncio.to_thread(try_acquire_lock, name, owner)
+
+    renewal = asyncio.create_task(renew())
+    try:
+        yield
+    finally:
+        renewal.cancel()
+        await asyncio.to_thread(release_lock, name, owner)
+
+@DB_CALL_SECONDS.time(call='consume_payment')
+def consume_payment(tx_hash, user_id, value):
+    """Mark a payment hash as redeemed by a user and return the time it was first redeemed.
+
+    Returns None if another user redeemed it. The same user gets the first redemption time back, so a
+    verification that failed halfway can be retried without the payment window starting over.
+    """
+    redeemed_at = time.time()
+    try:
+        payments_collection.insert_one({"hash": tx_hash, "user_id": user_id, "value": value, "redeemed_at": redeemed_at})
+    except DuplicateKeyError:
+        payment = payments_collection.find_one({"hash": tx_hash}, {"_id": 0, "user_id": 1, "redeemed_at": 1})
+        if payment is None or payment['user_id'] != user_id:
+            return None
+        return payment['redeemed_at']
+    return redeemed_at
+
+@DB_CALL_SECONDS.time(call='record_token_sightings')
+def record_token_sightings(wallet, sightings):
+    """Fold the tokens seen in one wallet's scan into the token index; return the token documents that changed.
+
+    `sightings` maps contract address -> (symbols, first_seen, valid, spam) for the wallet. A wallet counts
+    once per token however often it is scanned, so rescans of a wallet usually write nothing.
+    """
+    if not sightings:
+        return []
+    seen = {doc['contract']: doc for doc in token_wallets_collection.find(
+        {"wallet": wallet, "contract": {"$in": list(sightings)}}, {"_id": 0, "contract": 1, "valid": 1, "spam": 1})}
+
+    now = time.time()
+    changed = []
+    pair_updates = []
+    token_updates = []
+    for contract, (symbols, first_seen, valid, spam) in sightings.items():
+        before = seen.get(contract, {})
+        counts = {}
+        if not before:
+            counts['wallets'] = 1
+        if valid and not before.get('valid'):
+            counts['valid_wallets'] = 1
+        if spam and not before.get('spam'):
+            counts['spam_wallets'] = 1
+        if not counts:
+            continue
+        changed.append(contract)
+        pair_updates.append(UpdateOne({"wallet": wallet, "contract": contract},
+                                      {"$max": {"valid": valid, "spam": spam}}, upsert=True))
+        token_updates.append(UpdateOne({"_id": contract}, {
+            "$min": {"first_seen": first_seen},
+            "$addToSet": {"symbols": {"$each": sorted(symbols)}},
+            "$inc": counts,
+            "$set": {"updated_at": now},
+        }, upsert=True))
+
+    if not changed:
+        return []
+    token_wallets_collection.bulk_write(pair_updates, ordered=False)
+    tokens_collection.bulk_write(token_updates, ordered=False)
+    return list(tokens_collection.find({"_id": {"$in": changed}}))
+
+def set_token_verdicts(verdicts):
+    """Store contract address -> verdict, leaving verdicts an admin set by hand alone."""
+    if verdicts:
+        now = time.time()
+        tokens_collection.bulk_write([
+            UpdateOne({"_id": contract, "manual": {"$ne": True}}, {"$set": {"verdict": verdict, "updated_at": now}})
+            for contract, verdict in verdicts.items()
+        ], ordered=False)
+
+def set_manual_token_verdict(contract, verdict):
+    """Pin a token's verdict, or with verdict None hand it back to the automatic rules."""
+    if verdict is None:
+        update = {"$unset": {"manual": ""}, "$set": {"updated_at": time.time()}}
+    else:
+        update = {"$set": {"verdict": verdict, "manual": True, "updated_at": time.time()}}
+    return tokens_collection.find_one_and_update({"_id": contract}, update, upsert=True,
+                                                 return_document=ReturnDocument.AFTER)
+
+@DB_CALL_SECONDS.time(call='find_tokens')
+def find_tokens(updated_since=None):
+    """Return the token documents changed after a time.time() value, or all of them."""
+    query = {} if updated_since is None else {"updated_at": {"$gt": updated_since}}
+    return list(tokens_collection.find(query))
+
+def reset_token_index():
+    """Forget every sighting before a rebuild; tokens with a manual verdict keep it."""
+    token_wallets_collection.delete_many({})
+    tokens_collection.delete_many({"manual": {"$ne": True}})
+    tokens_collection.update_many({"manual": True}, {
+        "$set": {"symbols": [], "wallets": 0, "valid_wallets": 0, "spam_wallets": 0, "updated_at": time.time()},
+        "$unset": {"first_seen": ""},
+    })
+
+def enrol_watched_wallets(wallets, interval):
+    """Start watching newly registered wallets, checked right away, and stop watching the ones no user has any more."""
+    wallets = set(wallets)
+    watched = {doc['wallet'] for doc in watch_collection.find({}, {"_id": 0, "wallet": 1})}
+    now = time.time()
+    if wallets - watched:
+        watch_collection.bulk_write([
+            UpdateOne({"wallet": wallet}, {"$setOnInsert": {"interval": interval, "next_check": now}}, upsert=True)
+            for wallet in wallets - watched
+        ], ordered=False)
+    if watched - wallets:
+        watch_collection.delete_many({"wallet": {"$in": list(watched - wallets)}})
+
+@DB_CALL_SECONDS.time(call='find_due_wallets')
+def find_due_wallets(now, limit, skip=()):
+    """Return up to `limit` watch states whose next check is due, the most overdue first."""
+    return list(watch_collection.find({"next_check": {"$lte": now}, "wallet": {"$nin": list(skip)}}, {"_id": 0})
+                .sort("next_check", 1).limit(limit))
+
+def update_watch_state(wallet, checked_block, interval, next_check):
+    watch_collection.update_one({"wallet": wallet}, {"$set": {
+        "checked_block": checked_block, "interval": interval, "next_check": next_check}})
+
+def postpone_watch_check(wallet, next_check):
+    """Retry a failed check later, leaving what the last successful one recorded untouched."""
+    watch_collection.update_one({"wallet": wallet}, {"$set": {"next_check": next_check}})
@@ -0,0 +1,150 @@
+import time
+import asyncio
+from collections import OrderedDict, deque
+from settings import get_settings
+
+HIGH = 'high'  # Payment verification and other interactive lookups
+NORMAL = 'normal'  # Wallet history scans
+LOW = 'low'  # Background wallet watcher, served only when nobody else is waiting
+LANES = (HIGH, NORMAL, LOW)
+
+REQUESTS_PER_SECOND = 5  # Explorer limit for a single API key
+WAIT_SAMPLES = 1000  # Recent wait times kept per lane for the statistics
+
+_scheduler = None
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` tokens per second."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        """Take a token if one is available and return True, otherwise return False."""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self):
+        """Seconds until the next token becomes available."""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class RequestScheduler:
+    """Hands out API keys to callers at the pace the explorer allows.
+
+    Every key has its own token bucket and keys are used in rotation. Waiting callers are grouped by
+    owner (usually the wallet being scanned) and served round-robin, so one huge scan can't starve
+    other users, and each lane is only served when the lanes before it are empty.
+    """
+
+    def __init__(self, api_keys, rate=REQUESTS_PER_SECOND):
+        if not api_keys:
+            api_keys = ['']
+        self.api_keys = list(api_keys)
+        self.buckets = {key: TokenBucket(rate, max(rate, 1)) for key in self.api_keys}
+        self.next_key = 0
+        self.lanes = {lane: OrderedDict() for lane in LANES}  # owner -> deque of (future, enqueued_at)
+        self.waits = {lane: deque(maxlen=WAIT_SAMPLES) for lane in LANES}
+        self.served = {lane: 0 for lane in LANES}
+        self.wakeup = None
+        self.dispatcher = None
+
+    async def acquire(self, owner, priority=NORMAL):
+        """Wait for a free request slot and return the API key to use for it."""
+        loop = asyncio.get_running_loop()
+        if self.dispatcher is None or self.dispatcher.done() or self.dispatcher.get_loop() is not loop:
+            self.wakeup = asyncio.Event()
+            self.dispatcher = loop.create_task(self._dispatch())
+
+        future = loop.create_future()
+        self.lanes[priority].setdefault(owner, deque()).append((future, time.monotonic()))
+        self.wakeup.set()
+        return await future
+
+    def queue_depth(self):
+        """Number of callers waiting in each lane."""
+        return {lane: sum(len(queue) for queue in queues.values()) for lane, queues in self.lanes.items()}
+
+    def stats(self):
+        """Queue depth, served requests and recent wait times (in seconds) per lane."""
+        depth = self.queue_depth()
+        stats = {}
+        for lane in LANES:
+            waits = self.waits[lane]
+            stats[lane] = {
+                'queue_depth': depth[lane],
+                'served': self.served[lane],
+                'avg_wait': sum(waits) / len(waits) if waits else 0.0,
+                'max_wait': max(waits, default=0.0),
+            }
+        return stats
+
+    def _take_key(self):
+        """Return a key with a free token, or None and the time until one frees up."""
+        for i in range(len(self.api_keys)):
+            key = self.api_keys[(self.next_key + i) % len(self.api_keys)]
+            if self.buckets[key].try_take():
+                self.next_key = (self.next_key + i + 1) % len(self.api_keys)
+                return key, 0.0
+        return None, min(bucket.wait_time() for bucket in self.buckets.values())
+
+    def _pop_waiter(self):
+        """Pop the next live waiter from the first non-empty lane, owners in round-robin order within a lane."""
+        for lane in LANES:
+            queues = self.lanes[lane]
+            while queues:
+                owner, queue = next(iter(queues.items()))
+                future, enqueued_at = queue.popleft()
+                if queue:
+                    queues.move_to_end(owner)
+                else:
+                    del queues[owner]
+                if not future.done():
+                    return lane, future, enqueued_at
+        return None
+
+    async def _dispatch(self):
+        while True:
+            if not any(self.lanes.values()):
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+
+            key, delay = self._take_key()
+            if key is None:
+                await asyncio.sleep(delay)
+                continue
+
+            waiter = self._pop_waiter()
+            if waiter is None:
+                self.buckets[key].tokens += 1  # Everyone gave up waiting, return the token
+                continue
+            lane, future, enqueued_at = waiter
+            self.waits[lane].append(time.monotonic() - enqueued_at)
+            self.served[lane] += 1
+            future.set_result(key)
+
+
+def get_scheduler():
+    """Return the process-wide scheduler built from the comma-separated API_KEY pool.
+
+    With several worker processes each one gets an equal share of the keys' rate limit.
+    """
+    global _scheduler
+    if _scheduler is None:
+        settings = get_settings()
+        _scheduler = RequestScheduler(settings.api_keys, settings.api_rate_limit / settings.workers)
+    return _scheduler
@@ -0,0 +1,193 @@
+from array import array
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from scan_cache import ScanCache
+from transaction_report import format_transaction_line
+
+PAGE_SIZE = 8  # Transfers per page; eight long spam rows still fit in one message
+BROWSE_TTL = 60 * 60  # Seconds a report can be paged through before it is rebuilt from the stored history
+MAX_BROWSED_TRANSFERS = 2_000_000  # Total transfers of the scans all open reports refer to
+
+VALID = 'valid'
+INVALID = 'invalid'
+# Direction filters, cycled through by their button
+ALL, IN, OUT = 'a', 'i', 'o'
+DIRECTIONS = (ALL, IN, OUT)
+DIRECTION_LABELS = {ALL: "↔️ In & out", IN: "➡️💳 Incoming", OUT: "💳➡️ Outgoing"}
+EXPORT = 'x'
+PICK = 't'  # Page prefix of the token picker: 't2' is its third page
+PICKER_PAGE_SIZE = 10  # Token buttons per page of the token picker
+BUTTON_SYMBOL_LENGTH = 24  # Spam token symbols are often whole URLs
+
+_browser = None
+
+
+class ReportIndex:
+    """The rows of one report of a scan, with the row positions of every filter built once and kept.
+
+    A report is the valid transfers, or for INVALID the invalid ones that moved a non-zero amount.
+    Tokens are told apart by contract address and numbered from 1 in order of appearance; token 0
+    means all tokens. A page is a slice of a filter's positions, so turning pages never walks the report.
+    """
+
+    def __init__(self, result, report, wallet_address):
+        self.report = report
+        self.wallet_address = wallet_address
+        self.wallet = wallet_address.lower()
+        self.result = result
+        view = result.valid if report == VALID else result.invalid
+        self.batch = batch = view.batch
+        if report == VALID:
+            rows = view.indices
+        else:
+            values = batch.values
+            rows = array('q', (i for i in view.indices if values[i] > 0))
+        contracts = batch.contract_addresses
+        tokens = {}  # Contract address -> the symbol it was first seen with
+        for i in rows:
+            if contracts[i] not in tokens:
+                tokens[contracts[i]] = batch.token_symbols[i]
+        self.tokens = list(tokens.items())
+        self.selections = {(0, ALL): rows}
+
+    def __len__(self):
+        return len(self.selections[0, ALL])
+
+    def select(self, token, direction):
+        """Row positions in the batch of the transfers of token number `token` going `direction`."""
+        key = (token, direction)
+        rows = self.selections.get(key)
+        if rows is None:
+            batch = self.batch
+            if direction != ALL:
+                addresses = batch.to_addresses if direction == IN else batch.from_addresses
+                rows = array('q', (i for i in self.select(token, ALL) if addresses[i] == self.wallet))
+            else:
+                contracts, contract = batch.contract_addresses, self.tokens[token - 1][0]
+                rows = array('q', (i for i in self.selections[0, ALL] if contracts[i] == contract))
+            self.selections[key] = rows
+        return rows
+
+
+class ResultBrowser:
+    """Reports that were sent as browsable messages, kept per wallet so page taps are answered from memory.
+
+    Entries are weighed by the size of the scan they refer to and expire like scan results do.
+    """
+
+    def __init__(self, ttl=BROWSE_TTL, max_weight=MAX_BROWSED_TRANSFERS):
+        self.reports = ScanCache(ttl, max_weight)
+
+    def open(self, wallet_address, report, result):
+        """Index a report of a ScanResult for browsing and return its ReportIndex."""
+        index = ReportIndex(result, report, wallet_address)
+        self.reports.put((wallet_address.lower(), report), index, weight=len(index.batch))
+        return index
+
+    def get(self, wallet_address, report):
+        """The ReportIndex last opened for a wallet's report, or None if it expired or another process opened it."""
+        return self.reports.get((wallet_address.lower(), report))
+
+
+def callback_data(report, page, token, direction):
+    return f"browse:{report}:{page}:{token}:{direction}"
+
+
+def parse_callback_data(data):
+    """Split a browse button's callback data into (report, page, token, direction).
+
+    page is EXPORT for the CSV button and a PICK string like 't2' for a page of the token picker.
+    """
+    _, report, page, token, direction = data.split(':')
+    if page != EXPORT and not page.startswith(PICK):
+        page = int(page)
+    return report, page, int(token), direction
+
+
+def clamp_filter(index, token, direction):
+    """Fall back to all tokens and directions when a filter doesn't fit a rebuilt report any more."""
+    if not 0 <= token <= len(index.tokens):
+        token = 0
+    if direction not in DIRECTIONS:
+        direction = ALL
+    return token, direction
+
+
+def render_page(index, page, token=0, direction=ALL):
+    """Render one page of a report as Markdown text and the keyboard to browse it."""
+    token, direction = clamp_filter(index, token, direction)
+    rows = index.select(token, direction)
+    pages = max(1, -(-len(rows) // PAGE_SIZE))
+    page = min(max(page, 0), pages - 1)
+    batch = index.batch
+
+    if index.report == VALID:
+        text = f"✅ Total Valid Transactions: {len(index)}\n\n"
+    else:
+        text = f"❌ Total Invalid Transactions: {len(index.result.invalid)}\n\n📜 Invalid Transactions:\n"
+    if token or direction != ALL:
+        token_name = f"`{index.tokens[token - 1][1]}`" if token else "all tokens"
+        text += f"🔎 {token_name}, {DIRECTION_LABELS[direction]}: {len(rows)}\n"
+    text += f"📄 Page {page + 1}/{pages}\n\n"
+    for i in rows[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]:
+        text += format_transaction_line(batch[i], index.wallet_address, show_nonce=index.report == VALID)
+    if not rows:
+        text += "No transactions match this filter.\n"
+
+    report = index.report
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=callback_data(report, page - 1, token, direction)))
+    if page < pages - 1:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=callback_data(report, page + 1, token, direction)))
+    # The token button opens the picker at the current token, the direction button switches to the next
+    # direction; both start again from page 1
+    next_direction = DIRECTIONS[(DIRECTIONS.index(direction) + 1) % len(DIRECTIONS)]
+    filters = [
+        InlineKeyboardButton(f"🪙 {index.tokens[token - 1][1][:BUTTON_SYMBOL_LENGTH] if token else 'All tokens'}",
+                             callback_data=callback_data(report, f"{PICK}{token // PICKER_PAGE_SIZE}", token, direction)),
+        InlineKeyboardButton(DIRECTION_LABELS[direction], callback_data=callback_data(report, 0, token, next_direction)),
+    ]
+    export = [InlineKeyboardButton("📎 Export CSV", callback_data=callback_data(report, EXPORT, token, direction))]
+    keyboard = [row for row in (navigation, filters, export) if row]
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def render_token_picker(index, picker_page, token=0, direction=ALL):
+    """Render one page of the token picker: a button per token that shows the report filtered to it."""
+    token, direction = clamp_filter(index, token, direction)
+    choices = len(index.tokens) + 1  # All tokens, then every token in order
+    pages = -(-choices // PICKER_PAGE_SIZE)
+    picker_page = min(max(picker_page, 0), pages - 1)
+    report = index.report
+
+    text = f"🪙 Choose a token to show ({len(index.tokens)} tokens)\n📄 Page {picker_page + 1}/{pages}\n"
+    keyboard = []
+    for choice in range(picker_page * PICKER_PAGE_SIZE, min((picker_page + 1) * PICKER_PAGE_SIZE, choices)):
+        label = f"{choice}. {index.tokens[choice - 1][1][:BUTTON_SYMBOL_LENGTH]}" if choice else "All tokens"
+        if choice == token:
+            label = f"✔️ {label}"
+        keyboard.append([InlineKeyboardButton(label, callback_data=callback_data(report, 0, choice, direction))])
+    navigation = []
+    if picker_page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=callback_data(report, f"{PICK}{picker_page - 1}", token, direction)))
+    if picker_page < pages - 1:
+        navigation.append(InlineKeyboardButton("Next ➡️", callback_data=callback_data(report, f"{PICK}{picker_page + 1}", token, direction)))
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton("↩️ Back", callback_data=callback_data(report, 0, token, direction))])
+    return text, InlineKeyboardMarkup(keyboard)
+
+
+def render(index, page, token=0, direction=ALL):
+    """Render what a browse button asked for: a page of the report, or with a PICK page one of the token picker."""
+    if isinstance(page, str):
+        return render_token_picker(index, int(page[len(PICK):]), token, direction)
+    return render_page(index, page, token, direction)
+
+
+def get_browser():
+    """Return the process-wide result browser."""
+    global _browser
+    if _browser is None:
+        _browser = ResultBrowser()
+    return _browser
@@ -0,0 +1,65 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+CACHE_TTL = 15 * 60  # Seconds a scan result stays usable
+MAX_CACHED_TRANSFERS = 2_000_000  # Total transfers held by all cached results together
+
+
+class ScanCache:
+    """In-process cache of wallet scan results with TTL and size-bounded LRU eviction.
+
+    Each entry carries a weight (the number of transfers it holds) and the least recently used
+    entries are evicted once the total weight goes over `max_weight`. Concurrent callers asking
+    for the same computation share one in-flight task instead of starting duplicates.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_weight=MAX_CACHED_TRANSFERS):
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.entries = OrderedDict()  # key -> (expires_at, weight, value)
+        self.total_weight = 0
+        self.in_flight = {}
+
+    def get(self, key):
+        """Return the cached value for a key, or None if it is missing or expired."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self._remove(key)
+            return None
+        self.entries.move_to_end(key)
+        return entry[2]
+
+    def put(self, key, value, weight=1, ttl=None):
+        """Store a value for `ttl` seconds (the cache's TTL by default) and evict the least recently used entries beyond the size bound."""
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), weight, value)
+        self.total_weight += weight
+        while self.total_weight > self.max_weight and len(self.entries) > 1:
+            self._remove(next(iter(self.entries)))
+
+    def _remove(self, key):
+        _, weight, _ = self.entries.pop(key)
+        self.total_weight -= weight
+
+    async def coalesce(self, name, factory):
+        """Run factory() once for all concurrent callers using the same name and share its result.
+
+        The computation is cancelled only when every caller waiting on it has been cancelled.
+        """
+        entry = self.in_flight.get(name)
+        if entry is None:
+            task = asyncio.ensure_future(factory())
+            entry = self.in_flight[name] = [task, 0]
+            task.add_done_callback(lambda done: self.in_flight.pop(name) if self.in_flight.get(name) is entry else None)
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
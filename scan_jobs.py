@@ -0,0 +1,171 @@
+import time
+import asyncio
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from main_utils import ScanProgress, scan_wallet
+from telegram_output import get_outbox
+from metrics import SCAN_QUEUE_SECONDS, log_summary
+
+MAX_CONCURRENT_SCANS = 4  # Heavy scans running at once; the rest wait in line
+PROGRESS_INTERVAL = 3  # Seconds between progress message edits
+
+CANCEL_MARKUP = InlineKeyboardMarkup([[InlineKeyboardButton("✖️ Cancel", callback_data='cancel_scan')]])
+
+# Outcomes of ScanJobManager.submit
+STARTED = 'started'
+ATTACHED = 'attached'
+DUPLICATE = 'duplicate'
+
+_job_manager = None
+
+
+class ScanJob:
+    """A wallet scan running in the background and the reports waiting for its result."""
+
+    def __init__(self, wallet_address, chat_id):
+        self.wallet_address = wallet_address
+        self.chat_id = chat_id
+        self.progress = ScanProgress()
+        self.deliveries = {}  # (chat_id, report) -> coroutine function called with the ScanResult
+        self.message = None
+        self.task = None
+        self.started_at = time.monotonic()
+
+
+class ScanJobManager:
+    """Runs at most one scan per wallet and at most `max_concurrent` scans overall.
+
+    Each job keeps a single progress message up to date with a Cancel button. Asking for another
+    report of a wallet that is already being scanned joins the running job instead of starting a new one.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_SCANS):
+        self.jobs = {}  # Lower-cased wallet address -> ScanJob
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.queued = 0
+
+    async def submit(self, bot, chat_id, wallet_address, report, deliver):
+        """Queue `deliver(result)` for the wallet's next scan result, starting a scan if none is running.
+
+        Returns STARTED, ATTACHED (joined a running scan) or DUPLICATE (this report is already on its way).
+        """
+        key = wallet_address.lower()
+        job = self.jobs.get(key)
+        if job is not None:
+            if (chat_id, report) in job.deliveries:
+                return DUPLICATE
+            job.deliveries[chat_id, report] = deliver
+            return ATTACHED
+
+        job = self.jobs[key] = ScanJob(wallet_address, chat_id)
+        job.deliveries[chat_id, report] = deliver
+        try:
+            job.message = await get_outbox(bot).send_message(chat_id, self._status_text(job), reply_markup=CANCEL_MARKUP)
+        except Exception:
+            del self.jobs[key]
+            raise
+        job.task = asyncio.create_task(self._run(bot, job))
+        return STARTED
+
+    def cancel(self, wallet_address):
+        """Cancel the running scan of a wallet; return False if there is none."""
+        job = self.jobs.get(wallet_address.lower())
+        if job is None or job.task is None:
+            return False
+        job.task.cancel()
+        return True
+
+    async def _run(self, bot, job):
+        outbox = get_outbox(bot)
+        reporter = asyncio.create_task(self._report_progress(outbox, job))
+        try:
+            self.queued += 1
+            try:
+                await self.slots.acquire()
+            finally:
+                self.queued -= 1
+            job.progress.timings['queue'] = time.monotonic() - job.started_at
+            SCAN_QUEUE_SECONDS.observe(job.progress.timings['queue'])
+            try:
+                result = await scan_wallet(job.wallet_address, progress=job.progress)
+            finally:
+                self.slots.release()
+        except asyncio.CancelledError:
+            await self._finish(outbox, job, reporter, "✖️ The scan was cancelled.")
+            await self._tell_joined(outbox, job, "✖️ The scan your report was waiting for was cancelled. Please ask for it again.")
+            self._log(job, 'cancelled')
+            return
+        except Exception as e:
+            print(f"Scan of {job.wallet_address} failed: {e}")
+            await self._finish(outbox, job, reporter, "❌ The scan failed. Please try again in a few minutes.")
+            await self._tell_joined(outbox, job, "❌ The scan failed. Please try again in a few minutes.")
+            self._log(job, 'failed')
+            return
+
+        elapsed = time.monotonic() - job.started_at
+        await self._finish(outbox, job, reporter,
+                           f"✅ Analysed {len(result.valid) + len(result.invalid)} transactions in {elapsed:.0f}s.")
+        delivered_at = time.monotonic()
+        for deliver in job.deliveries.values():
+            try:
+                await deliver(result)
+            except Exception as e:
+                print(f"Sending scan results of {job.wallet_address} failed: {e}")
+        job.progress.timings['deliver'] = time.monotonic() - delivered_at
+        self._log(job, 'done', valid=len(result.valid), invalid=len(result.invalid))
+
+    def _log(self, job, outcome, **fields):
+        """Write the structured summary of a finished job."""
+        progress = job.progress
+        log_summary('scan', wallet=job.wallet_address, outcome=outcome,
+                    seconds=round(time.monotonic() - job.started_at, 3),
+                    reports=[report for _, report in job.deliveries], pages=progress.pages, fetched=progress.fetched,
+                    transactions=progress.transactions, cached=progress.cached,
+                    timings={stage: round(seconds, 3) for stage, seconds in progress.timings.items()}, **fields)
+
+    async def _finish(self, outbox, job, reporter, text):
+        reporter.cancel()
+        self.jobs.pop(job.wallet_address.lower(), None)
+        await self._edit(outbox, job, text, reply_markup=None)
+
+    async def _tell_joined(self, outbox, job, text):
+        """Send `text` to the chats that joined the job, which have no progress message of their own."""
+        for chat_id in {chat_id for chat_id, _ in job.deliveries} - {job.chat_id}:
+            try:
+                await outbox.send_message(chat_id, text)
+            except Exception as e:
+                print(f"Could not tell chat {chat_id} about the scan of {job.wallet_address}: {e}")
+
+    async def _report_progress(self, outbox, job):
+        shown = self._status_text(job)
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            text = self._status_text(job)
+            if text != shown:
+                await self._edit(outbox, job, text, reply_markup=CANCEL_MARKUP)
+                shown = text
+
+    async def _edit(self, outbox, job, text, reply_markup):
+        try:
+            await outbox.edit_message_text(job.chat_id, job.message.message_id, text, reply_markup=reply_markup)
+        except BadRequest as e:
+            print(f"Could not update scan progress: {e}")
+
+    def _status_text(self, job):
+        progress = job.progress
+        if progress.stage == 'queued':
+            return f"⏳ Your scan is queued behind other scans ({self.queued} waiting). It will start shortly."
+        if progress.stage == 'fetching':
+            return (f"🔍 Getting your transactions from the BSC blockchain network...\n\n"
+                    f"📄 Pages received: {progress.pages}\n🔄 New transactions: {progress.fetched}")
+        if progress.stage == 'loading':
+            return "📥 Loading your transaction history..."
+        return f"🧮 Analysing {progress.transactions} transactions..."
+
+
+def get_job_manager():
+    """Return the process-wide scan job manager."""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = ScanJobManager()
+    return _job_manager
@@ -0,0 +1,170 @@
+"""Streaming wallet scans: explorer pages flow through the classifier into a renderer as they arrive.
+
+    python scan_stream.py 0x... > valid_transactions.csv
+    python scan_stream.py 0x... --invalid > invalid_transactions.csv
+
+Nothing waits for the whole history: the first CSV rows are written once the first page has been
+classified, and memory stays bounded by a few pages plus the classifier's hold window however long
+the history is. The totals (counts, balance, suspicious tokens) are printed to stderr at the end.
+"""
+import io
+import csv
+import sys
+import asyncio
+import argparse
+from collections import defaultdict
+from main_utils import END_BLOCK, MAX_RESULT_WINDOW, IncrementalClassifier, get_page, split_last_block, balance_from_raw_totals
+from transactions import TransactionBatch
+from transaction_report import CSV_COLUMNS, csv_row
+from token_reputation import get_token_index
+from request_scheduler import NORMAL
+from settings import get_settings
+
+PREFETCH_PAGES = 2  # Pages fetched ahead of the classifier before the fetcher waits
+
+
+async def fetch_pages(wallet_address, start_block=0, priority=NORMAL, progress=None):
+    """Yield the wallet's transfers from start_block onward one explorer page at a time, as TransactionBatches.
+
+    Pages are requested in block order, each starting at the block the previous one ended in, and the
+    next page is already being fetched while the consumer works on the current one. At most
+    PREFETCH_PAGES pages wait for the consumer. Raises BscScanError like get_bep20_transactions.
+    """
+    pages = asyncio.Queue(PREFETCH_PAGES)
+
+    async def fetch():
+        try:
+            block = start_block
+            while True:
+                transactions = await get_page(wallet_address, block, END_BLOCK, priority, progress)
+                if len(transactions) < MAX_RESULT_WINDOW:
+                    await pages.put(transactions)
+                    break
+                # The page may end in the middle of a block; that block is requested again in full
+                head, next_block = split_last_block(transactions)
+                if not head:
+                    print(f"Block {next_block} holds more than {MAX_RESULT_WINDOW} transfers of {wallet_address}, result truncated")
+                    head, next_block = transactions, next_block + 1
+                await pages.put(head)
+                block = next_block
+            await pages.put(None)
+        except Exception as e:
+            await pages.put(e)
+
+    fetcher = asyncio.create_task(fetch())
+    try:
+        while True:
+            transactions = await pages.get()
+            if transactions is None:
+                return
+            if isinstance(transactions, Exception):
+                raise transactions
+            yield TransactionBatch.from_api(transactions)
+    finally:
+        fetcher.cancel()
+
+
+class StreamTotals:
+    """Counts, balance and suspicious tokens of a streamed scan, summed up page by page."""
+
+    def __init__(self, wallet_address):
+        self.wallet = wallet_address.lower()
+        self.transactions = 0
+        self.valid = 0
+        self.invalid = 0
+        self.spam = 0
+        self.raw_totals = defaultdict(int)
+        self.invalid_tokens = {}
+
+    def add(self, valid, invalid):
+        """Count the transfers of one classified page."""
+        self.transactions += len(valid) + len(invalid)
+        self.valid += len(valid)
+        self.invalid += len(invalid)
+        for tx in valid:
+            if tx.to_address == self.wallet:
+                self.raw_totals[tx.token_symbol, tx.token_decimal] += tx.value
+            if tx.from_address == self.wallet:
+                self.raw_totals[tx.token_symbol, tx.token_decimal] -= tx.value
+        for tx in invalid:
+            if tx.amount > 0:
+                self.spam += 1
+                self.invalid_tokens.setdefault(tx.contract_address, tx.token_symbol)
+
+    def summary(self):
+        """The totals in batch_scan's JSON shape."""
+        return {
+            'transactions': self.transactions,
+            'valid': self.valid,
+            'invalid': self.invalid,
+            'spam': self.spam,
+            'balance': balance_from_raw_totals(self.raw_totals),
+            'suspicious_tokens': self.invalid_tokens,
+        }
+
+
+async def stream_scan(wallet_address, start_block=0, priority=NORMAL, progress=None, totals=None):
+    """Yield (valid, invalid) lists of Transfers as the wallet's history is fetched and classified.
+
+    Across all pairs the transfers come out in the same order classify_transactions returns them.
+    Forged and spam tokens are blocked from the token index like in the bot's scans, forged contracts
+    no scan has recorded yet from the page they first appear in. A StreamTotals passed in is updated with every pair.
+    """
+    token_index = get_token_index()
+    await token_index.refresh()
+    classifier = IncrementalClassifier(wallet_address, get_settings().valid_tokens, token_index.blocked)
+    async for transactions in fetch_pages(wallet_address.lower(), start_block, priority, progress):
+        classifier.blocked_contracts = classifier.blocked_contracts | token_index.blocked_for(transactions)
+        classified = classifier.classify(transactions)
+        if totals is not None:
+            totals.add(*classified)
+        yield classified
+    classified = classifier.finish()
+    if totals is not None:
+        totals.add(*classified)
+    yield classified
+    if classifier.forced:
+        print(f"Hold window of the {wallet_address} stream was full; {classifier.forced} outgoing transfers were released before they were final")
+
+
+async def render_csv(classified, wallet_address, invalid=False):
+    """Yield a CSV document in chunks, one per classified page, from stream_scan's pairs.
+
+    With `invalid` the document lists the spam transfers (invalid ones that moved a non-zero amount).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    async for valid_transactions, invalid_transactions in classified:
+        transactions = [tx for tx in invalid_transactions if tx.amount > 0] if invalid else valid_transactions
+        for tx in transactions:
+            writer.writerow(csv_row(tx, wallet_address))
+        chunk = buffer.getvalue()
+        if chunk:
+            buffer.seek(0)
+            buffer.truncate()
+            yield chunk
+
+
+async def run(args):
+    from bscscan import close_client
+    totals = StreamTotals(args.wallet)
+    try:
+        async for chunk in render_csv(stream_scan(args.wallet, totals=totals), args.wallet, args.invalid):
+            sys.stdout.write(chunk)
+            sys.stdout.flush()
+    finally:
+        await close_client()
+    print(totals.summary(), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('wallet', help="wallet address to scan")
+    parser.add_argument('--invalid', action='store_true', help="write the spam transfers instead of the valid ones")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from dotenv import load_dotenv
+
+LOGO_PATH = 'img/mark.webp'
+BSCSCAN_API_URL = 'https://api.bscscan.com/api'
+MONGODB_DATABASE = 'wallet_db'
+WEBHOOK_LISTEN = '127.0.0.1'  # The listener sits behind a TLS-terminating reverse proxy on the same host
+WEBHOOK_PORT = 8080
+CONCURRENT_UPDATES = 256  # python-telegram-bot's default when concurrent updates are on
+# Genuine BSC contracts of well-known tokens; transfers claiming these symbols from any other contract are forged
+TOKEN_CONTRACTS = 'BSC-USD=0x55d398326f99059ff775485246999027b3197955,USDC=0x8ac76a51cc950d9822d68b83fe1ad97b32cd580d'
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Configuration read once from the environment and the .env file."""
+
+    telegram_token: str
+    admin_id: str
+    wallet_address: str  # Payment wallet
+    valid_tokens: tuple
+    api_keys: tuple
+    api_rate_limit: float
+    bscscan_api_url: str  # Point at a stand-in server to run without the real explorer
+    mongodb_uri: str
+    mongodb_database: str
+    metrics_port: int  # Local port of the /metrics endpoint, 0 to disable it; worker N listens on port + N
+    webhook_url: str  # Public HTTPS URL Telegram posts updates to; polling is used when it is empty
+    webhook_listen: str
+    webhook_port: int
+    webhook_secret: str  # Required in webhook mode; Telegram sends it with every update
+    workers: int  # Bot processes sharing the webhook listener
+    concurrent_updates: int  # Updates each process handles at once
+    classify_processes: int  # Processes classifying large wallets off the event loop
+    token_contracts: tuple  # (token symbol, genuine contract address) pairs
+    watch_wallets: bool  # Keep registered wallets scanned in the background and alert users to new spam
+    watch_share: float  # Share of the explorer rate limit the wallet watcher may start checks at
+
+
+def _split(value):
+    return tuple(item.strip() for item in value.split(',') if item.strip()) if value else ()
+
+
+@lru_cache(maxsize=None)
+def get_settings():
+    """Return the bot settings, parsing the environment on first use."""
+    load_dotenv()
+    return Settings(
+        telegram_token=os.getenv("TELEGRAM_TOKEN"),
+        admin_id=os.getenv("ADMIN_ID"),
+        wallet_address=os.getenv("WALLET_ADDRESS") or '',
+        valid_tokens=tuple(os.getenv('VALID_TOKENS', '').split(',')) if os.getenv('VALID_TOKENS') else (),
+        api_keys=_split(os.getenv("API_KEY")),
+        api_rate_limit=float(os.getenv("API_RATE_LIMIT", 5)),
+        bscscan_api_url=os.getenv("BSCSCAN_API_URL", BSCSCAN_API_URL),
+        mongodb_uri=os.getenv("MONGODB_URI"),
+        mongodb_database=os.getenv("MONGODB_DATABASE", MONGODB_DATABASE),
+        metrics_port=int(os.getenv("METRICS_PORT", 0)),
+        webhook_url=os.getenv("WEBHOOK_URL", ''),
+        webhook_listen=os.getenv("WEBHOOK_LISTEN", WEBHOOK_LISTEN),
+        webhook_port=int(os.getenv("WEBHOOK_PORT", WEBHOOK_PORT)),
+        webhook_secret=os.getenv("WEBHOOK_SECRET", ''),
+        workers=max(1, int(os.getenv("WORKERS", 1))),
+        concurrent_updates=int(os.getenv("CONCURRENT_UPDATES", CONCURRENT_UPDATES)),
+        classify_processes=int(os.getenv("CLASSIFY_PROCESSES", os.cpu_count() or 1)),
+        token_contracts=tuple((symbol.strip(), contract.strip().lower()) for symbol, _, contract in
+                              (pair.partition('=') for pair in _split(os.getenv("TOKEN_CONTRACTS", TOKEN_CONTRACTS)))),
+        watch_wallets=os.getenv("WATCH_WALLETS", '1').lower() not in ('0', 'false', 'no', ''),
+        watch_share=float(os.getenv("WATCH_SHARE", 0.5)),
+    )
+
+
+class Logo:
+    """The welcome image, read from disk once and re-sent by Telegram file_id after its first upload."""
+
+    def __init__(self, path=LOGO_PATH):
+        self.path = path
+        self.data = None
+        self.file_id = None
+
+    def load(self):
+        """Read the image into memory."""
+        with open(self.path, 'rb') as photo:
+            self.data = photo.read()
+
+    def photo(self):
+        """What to pass as `photo=`: the cached file_id if known, otherwise the image bytes."""
+        if self.file_id is None and self.data is None:
+            self.load()
+        return self.file_id or self.data
+
+    def remember(self, message):
+        """Keep the file_id Telegram assigned to the uploaded image."""
+        if self.file_id is None and message.photo:
+            self.file_id = message.photo[-1].file_id
+
+
+logo = Logo()
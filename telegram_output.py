@@ -0,0 +1,135 @@
+import asyncio
+from collections import deque
+from telegram.error import RetryAfter
+from request_scheduler import TokenBucket
+from settings import get_settings
+from metrics import TELEGRAM_SEND_SECONDS, TELEGRAM_MESSAGES, TELEGRAM_RETRY_AFTER, TELEGRAM_RETRY_AFTER_SECONDS
+
+MESSAGE_LIMIT = 4096  # Telegram's maximum message length in UTF-16 code units
+GLOBAL_RATE = 30  # Messages per second the bot may send across all chats
+CHAT_RATE = 1  # Messages per second to a single chat
+CHAT_BURST = 3
+
+_outbox = None
+
+
+def text_length(text):
+    """Length of a text the way Telegram counts it (UTF-16 code units)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def pack_lines(lines, header='', limit=MESSAGE_LIMIT):
+    """Pack lines into as few messages as possible, each within Telegram's size limit."""
+    message = header
+    size = text_length(header)
+    for line in lines:
+        line_size = text_length(line)
+        if message and size + line_size > limit:
+            yield message
+            message, size = '', 0
+        message += line
+        size += line_size
+    if message:
+        yield message
+
+
+class _Chat:
+    __slots__ = ('queue', 'bucket')
+
+    def __init__(self, rate, burst):
+        self.queue = deque()
+        self.bucket = TokenBucket(rate, burst)
+
+
+class Outbox:
+    """Per-chat outbound message queues paced by global and per-chat token buckets.
+
+    Messages to one chat are delivered in the order they were queued. Every send honours
+    RetryAfter by waiting the requested time and trying again.
+    """
+
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chats = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        """Queue a text message and wait until it has been delivered."""
+        return await self._submit(chat_id, 'send_message', lambda: self.bot.send_message(chat_id=chat_id, text=text, **kwargs))
+
+    async def send_document(self, chat_id, document, filename, caption=None):
+        """Queue a document and wait until it has been delivered."""
+        return await self._submit(chat_id, 'send_document', lambda: self.bot.send_document(
+            chat_id=chat_id, document=document, filename=filename, caption=caption))
+
+    async def edit_message_text(self, chat_id, message_id, text, **kwargs):
+        """Queue an edit of an earlier message and wait until it has been applied."""
+        return await self._submit(chat_id, 'edit_message_text', lambda: self.bot.edit_message_text(
+            chat_id=chat_id, message_id=message_id, text=text, **kwargs))
+
+    async def send_lines(self, chat_id, lines, header='', **kwargs):
+        """Send lines packed into as few messages as the size limit allows; return the message count."""
+        count = 0
+        for message in pack_lines(lines, header):
+            await self.send_message(chat_id, message, **kwargs)
+            count += 1
+        return count
+
+    async def _submit(self, chat_id, method, send):
+        future = asyncio.get_running_loop().create_future()
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = _Chat(self.chat_rate, self.chat_burst)
+            asyncio.create_task(self._run_chat(chat_id, chat))
+        chat.queue.append((method, send, future))
+        return await future
+
+    async def _run_chat(self, chat_id, chat):
+        while True:
+            while chat.queue:
+                method, send, future = chat.queue.popleft()
+                if future.done():
+                    continue  # The sender was cancelled while this was queued
+                try:
+                    result = await self._deliver(chat.bucket, method, send)
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+            # Linger for one send interval so a quick follow-up still respects the chat's pace
+            await asyncio.sleep(1 / self.chat_rate)
+            if not chat.queue:
+                del self.chats[chat_id]
+                return
+
+    async def _deliver(self, bucket, method, send):
+        while True:
+            await _take(bucket)
+            await _take(self.global_bucket)
+            try:
+                with TELEGRAM_SEND_SECONDS.time(method=method):
+                    result = await send()
+            except RetryAfter as e:
+                TELEGRAM_RETRY_AFTER.inc()
+                TELEGRAM_RETRY_AFTER_SECONDS.inc(e.retry_after)
+                await asyncio.sleep(e.retry_after)
+            else:
+                TELEGRAM_MESSAGES.inc(method=method)
+                return result
+
+
+async def _take(bucket):
+    while not bucket.try_take():
+        await asyncio.sleep(bucket.wait_time())
+
+
+def get_outbox(bot):
+    """Return the process-wide outbox for the bot; worker processes split the global rate between them."""
+    global _outbox
+    if _outbox is None or _outbox.bot is not bot:
+        _outbox = Outbox(bot, global_rate=GLOBAL_RATE / get_settings().workers)
+    return _outbox
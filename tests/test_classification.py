@@ -0,0 +1,207 @@
+"""Golden-output tests: the single-pass and the streaming classifier against the original loop.
+
+The reference below is classify_transactions as the bot first shipped it, comments stripped and
+the valid tokens passed in. Its quirks are the behaviour users have seen, so both rewrites must
+reproduce them exactly: back-tracking matches the sender against the address as the user typed it,
+never revisits the first valid transfer and stops early once it has invalidated the newest one.
+"""
+import os
+import random
+import re
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from main_utils import classify_indices, IncrementalClassifier
+from transactions import TransactionBatch
+
+VALID_TOKENS = ('BSC-USD', 'USDC', 'LDOGE')
+WALLET = '0x307d75dcc97c9d4b12d9822f05087002310e7b57'
+GENUINE_CONTRACT = '0x55d398326f99059ff775485246999027b3197955'
+FORGED_CONTRACT = '0x00000000000000000000000000000000000f0f0f'
+SAMPLE_LOG = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'transactions_log.txt')
+MAX_STEPS = 10 ** 5  # Back-tracking steps after which the reference is taken to loop forever
+RANDOM_CASES = 600
+
+
+class EndlessLoop(Exception):
+    """The reference back-tracking loop never terminates on this history."""
+
+
+def reference_classify(transactions, wallet_address, valid_tokens):
+    """The original classifier, with a cap on its back-tracking loop."""
+    valid_transactions = []
+    invalid_transactions = []
+    tokens_nonce = 0
+    out_nonces = []
+
+    for tx in transactions:
+        tx_hash = tx['hash']
+        from_address = tx['from']
+        to_address = tx['to']
+        value = int(tx['value']) / (10 ** int(tx['tokenDecimal']))
+        confirmations = int(tx['confirmations'])
+        token_symbol = tx['tokenSymbol']
+        nonce = int(tx['nonce'])
+        nonce_valid = True
+        dt = datetime.fromtimestamp(int(tx['timeStamp']))
+
+        if from_address == wallet_address.lower():
+            nonce_valid = False
+        if token_symbol in valid_tokens:
+            if (dt.year < 2022 or (dt.year == 2022 and dt.month == 1)):
+                if value > 0 and (nonce - tokens_nonce >= 0 and nonce - tokens_nonce <= 5):
+                    nonce_valid = True
+                    tokens_nonce = nonce
+            else:
+                if from_address == wallet_address.lower():
+                    if value > 0 and (nonce - tokens_nonce >= -2) and (nonce - tokens_nonce <= 3) and (nonce not in out_nonces):
+                        if nonce - tokens_nonce < 0:
+                            back_no = 0
+                            steps = 0
+                            while (1):
+                                steps += 1
+                                if steps > MAX_STEPS:
+                                    raise EndlessLoop()
+                                back_no -= 1
+                                if (len(valid_transactions) + back_no > 0) and (valid_transactions[back_no]['from'] == wallet_address) and (int(valid_transactions[back_no]['nonce']) > nonce):
+                                    pre_tx = valid_transactions.pop(back_no)
+                                    invalid_transactions.append(pre_tx)
+                                    back_no += 1
+                                if (len(valid_transactions) + back_no > 0) and (valid_transactions[back_no]['from'] == wallet_address) and (int(valid_transactions[back_no]['nonce']) < nonce):
+                                    break
+                                if len(valid_transactions) + back_no == 0:
+                                    break
+                        nonce_valid = True
+                        tokens_nonce = nonce
+                        out_nonces.append(nonce)
+
+        if (tx_hash and from_address and to_address and value > 0
+                and confirmations > 0 and (token_symbol in valid_tokens) and nonce_valid):
+            valid_transactions.append(tx)
+        else:
+            invalid_transactions.append(tx)
+
+    return [tx['hash'] for tx in valid_transactions], [tx['hash'] for tx in invalid_transactions]
+
+
+def random_history(rng, size, wallet_address):
+    """Explorer rows mixing in and out transfers, nonce gaps and repeats, both nonce rule eras and junk rows."""
+    rows = []
+    nonce = rng.randint(0, 5)
+    timestamp = rng.choice([1600000000, 1643000000, 1650000000])
+    for i in range(size):
+        timestamp += rng.randint(0, 200000)
+        outgoing = rng.random() < 0.5
+        r = rng.random()
+        if r < 0.6:
+            nonce += rng.choice([0, 1, 1, 1, 2])
+        elif r < 0.8:
+            nonce = max(0, nonce - rng.choice([1, 2, 3]))
+        else:
+            nonce = rng.randint(max(0, nonce - 5), nonce + 6)
+        counterparty = '0x%040x' % rng.randint(0, 5)
+        rows.append({
+            # Hashes stay unique so results can be compared as hash lists; a few are missing altogether
+            'hash': f'0x{i:x}' if rng.random() > 0.01 else '',
+            # The sender is sometimes written exactly as the user typed the wallet, sometimes lower-cased
+            'from': (wallet_address if rng.random() < 0.8 else wallet_address.lower()) if outgoing else counterparty,
+            'to': counterparty if outgoing else wallet_address.lower(),
+            'contractAddress': GENUINE_CONTRACT if rng.random() < 0.9 else FORGED_CONTRACT,
+            'tokenSymbol': rng.choice(['BSC-USD', 'USDC', 'LDOGE', 'SPAM', 'USDC ']),
+            'tokenDecimal': '18',
+            'value': str(rng.choice([0, 1, 10 ** 18, 5 * 10 ** 17])) if rng.random() > 0.1 else '0',
+            'timeStamp': str(timestamp),
+            'nonce': str(nonce if outgoing else rng.randint(0, 50)),
+            'blockNumber': str(i),
+            'confirmations': str(rng.choice([0, 1, 100])) if rng.random() < 0.05 else '5',
+        })
+    return rows
+
+
+def sample_history():
+    """The transfer recorded in transactions_log.txt, back in explorer row form."""
+    rows = []
+    with open(SAMPLE_LOG, encoding='utf-8') as log:
+        for line in log:
+            fields = dict(re.findall(r'([A-Za-z ]+): ([^,]*)(?:, |$)', line.strip()))
+            decimals = int(fields['Token Decimal'])
+            rows.append({
+                'hash': fields['Hash'], 'from': fields['From'], 'to': fields['To'], 'contractAddress': GENUINE_CONTRACT,
+                'tokenSymbol': fields['Token Symbol'], 'tokenDecimal': str(decimals),
+                'value': str(int(Decimal(fields['Value']) * 10 ** decimals)),
+                'timeStamp': str(int(datetime.strptime(fields['Time'], '%Y-%m-%d %H:%M:%S').timestamp())),
+                'nonce': fields['Nonce'], 'blockNumber': fields['Block Number'], 'confirmations': fields['Confirmations'],
+            })
+    return rows
+
+
+def indices_result(rows, wallet_address, blocked_contracts=frozenset()):
+    batch = TransactionBatch.from_api(rows)
+    valid, invalid = classify_indices(batch, wallet_address, VALID_TOKENS, blocked_contracts)
+    return [batch.hashes[i] for i in valid], [batch.hashes[i] for i in invalid]
+
+
+def stream_result(rows, wallet_address, rng, blocked_contracts=frozenset()):
+    classifier = IncrementalClassifier(wallet_address, VALID_TOKENS, blocked_contracts)
+    valid, invalid = [], []
+    start = 0
+    while start < len(rows):
+        end = start + rng.randint(1, 40)
+        page_valid, page_invalid = classifier.classify(TransactionBatch.from_api(rows[start:end]))
+        valid += page_valid
+        invalid += page_invalid
+        start = end
+    page_valid, page_invalid = classifier.finish()
+    assert classifier.forced == 0
+    return [tx.hash for tx in valid + page_valid], [tx.hash for tx in invalid + page_invalid]
+
+
+def random_cases():
+    rng = random.Random(20241018)
+    for case in range(RANDOM_CASES):
+        # A third of the users typed their wallet with upper-case hex digits
+        wallet_address = WALLET if case % 3 else WALLET.upper().replace('0X', '0x')
+        yield case, wallet_address, random_history(rng, rng.randint(1, 300), wallet_address)
+
+
+def test_sample_log():
+    rows = sample_history()
+    assert rows
+    for wallet_address in (WALLET, rows[0]['from']):
+        expected = reference_classify(rows, wallet_address, VALID_TOKENS)
+        assert indices_result(rows, wallet_address) == expected
+        assert stream_result(rows, wallet_address, random.Random(0)) == expected
+
+
+@pytest.mark.parametrize('classify', ['indices', 'stream'])
+def test_random_histories(classify):
+    rng = random.Random(7)
+    compared = 0
+    for case, wallet_address, rows in random_cases():
+        try:
+            expected = reference_classify(rows, wallet_address, VALID_TOKENS)
+        except EndlessLoop:
+            continue
+        if classify == 'indices':
+            result = indices_result(rows, wallet_address)
+        else:
+            result = stream_result(rows, wallet_address, rng)
+        assert result == expected, f"case {case}"
+        compared += 1
+    assert compared > RANDOM_CASES * 0.9
+
+
+def test_blocked_contracts_are_not_valid_tokens():
+    """A blocked contract's transfers classify exactly like transfers of a token that isn't valid at all."""
+    rng = random.Random(3)
+    blocked = frozenset({FORGED_CONTRACT})
+    for case, wallet_address, rows in random_cases():
+        renamed = [dict(row, tokenSymbol='FORGED') if row['contractAddress'] in blocked else row for row in rows]
+        try:
+            expected = reference_classify(renamed, wallet_address, VALID_TOKENS)
+        except EndlessLoop:
+            continue
+        assert indices_result(rows, wallet_address, blocked) == expected, f"case {case}"
+        assert stream_result(rows, wallet_address, rng, blocked) == expected, f"case {case}"
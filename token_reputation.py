@@ -0,0 +1,247 @@
+"""Token reputation shared across every scanned wallet, keyed by contract address.
+
+Every scan records which token contracts reached the wallet, under which symbols and whether as
+valid or spam transfers. From that each contract gets a verdict: the genuine contract of a
+well-known token is trusted, another contract using one of those symbols is forged, and a token
+only ever airdropped as spam into several wallets is spam. The classifier treats forged and
+spam contracts as worthless tokens and the suspicious-token report shows what is known about each.
+
+    python token_reputation.py --rebuild                   # recompute the index from every stored history
+    python token_reputation.py --verdict 0x... spam        # pin a verdict by hand (auto to unpin)
+"""
+import sys
+import time
+import asyncio
+import argparse
+import unicodedata
+from collections import namedtuple
+from mongo import (record_token_sightings, set_token_verdicts, set_manual_token_verdict, find_tokens,
+                   reset_token_index, iter_synced_wallets)
+from settings import get_settings
+
+TRUSTED = 'trusted'
+FORGED = 'forged'
+SPAM = 'spam'
+UNKNOWN = 'unknown'
+VERDICTS = (TRUSTED, FORGED, SPAM, UNKNOWN)
+BLOCKED_VERDICTS = (FORGED, SPAM)  # Transfers of these contracts are never valid
+
+SPAM_WALLETS = 3  # Wallets a token that never moved validly must have been sent to before it counts as spam
+REFRESH_INTERVAL = 60  # Seconds the in-memory index is used before checking Mongo for changes
+CLOCK_SLACK = 5  # Seconds refreshes look back, for writes from worker processes with a slightly different clock
+
+TokenReputation = namedtuple('TokenReputation', ['verdict', 'symbols', 'wallets', 'first_seen'])
+
+_token_index = None
+
+
+def _normalize(symbol):
+    """Fold full-width and other look-alike characters, so 'ＵSDC' claims the same symbol as 'USDC'."""
+    return unicodedata.normalize('NFKC', symbol).upper()
+
+
+def judge(token):
+    """The verdict for a token document from the index."""
+    if token.get('manual'):
+        return token['verdict']
+    token_contracts = get_settings().token_contracts
+    if any(token['_id'] == contract for _, contract in token_contracts):
+        return TRUSTED
+    claimed = {_normalize(symbol) for symbol in token.get('symbols', ())}
+    if any(_normalize(symbol) in claimed for symbol, _ in token_contracts):
+        return FORGED
+    if token.get('spam_wallets', 0) >= SPAM_WALLETS and not token.get('valid_wallets'):
+        return SPAM
+    return UNKNOWN
+
+
+def collect_sightings(transactions, valid_indices, invalid_indices):
+    """Summarise a classified TransactionBatch per token contract: symbols, first seen, valid, spam."""
+    contracts = transactions.contract_addresses
+    symbols = transactions.token_symbols
+    timestamps = transactions.timestamps
+    values = transactions.values
+    sightings = {}
+
+    def sighting(i):
+        contract = contracts[i]
+        entry = sightings.get(contract)
+        if entry is None:
+            entry = sightings[contract] = [set(), timestamps[i], False, False]
+        entry[0].add(symbols[i])
+        entry[1] = min(entry[1], timestamps[i])
+        return entry
+
+    for i in valid_indices:
+        if contracts[i]:
+            sighting(i)[2] = True
+    for i in invalid_indices:
+        if contracts[i]:
+            entry = sighting(i)
+            if values[i] > 0:
+                entry[3] = True
+    return {contract: tuple(entry) for contract, entry in sightings.items()}
+
+
+def token_symbols(transactions):
+    """Map each token contract in a TransactionBatch to the set of symbols its transfers used."""
+    tokens = {}
+    for contract, symbol in set(zip(transactions.contract_addresses, transactions.token_symbols)):
+        tokens.setdefault(contract, set()).add(symbol)
+    return tokens
+
+
+def record_scan(wallet, transactions, valid_indices, invalid_indices):
+    """Record a classified scan in the index and return the token documents it changed."""
+    tokens = record_token_sightings(wallet.lower(), collect_sightings(transactions, valid_indices, invalid_indices))
+    verdicts = {}
+    for token in tokens:
+        verdict = judge(token)
+        if verdict != token.get('verdict'):
+            verdicts[token['_id']] = token['verdict'] = verdict
+    set_token_verdicts(verdicts)
+    return tokens
+
+
+class TokenIndex:
+    """In-memory copy of the token index for O(1) lookups, refreshed incrementally from Mongo."""
+
+    def __init__(self, interval=REFRESH_INTERVAL):
+        self.interval = interval
+        self.tokens = {}  # Contract address -> TokenReputation
+        self.blocked = frozenset()  # Contract addresses with a verdict in BLOCKED_VERDICTS
+        self.synced_until = None  # time.time() of the last refresh
+        self.refreshed_at = float('-inf')
+        self.lock = asyncio.Lock()
+        self.recordings = set()
+
+    def get(self, contract):
+        """The TokenReputation of a contract, or None if no scan has seen it yet."""
+        return self.tokens.get(contract)
+
+    async def refresh(self):
+        """Pick up token documents other processes changed, at most once per interval."""
+        if time.monotonic() - self.refreshed_at < self.interval:
+            return
+        async with self.lock:
+            if time.monotonic() - self.refreshed_at < self.interval:
+                return
+            started = time.time()
+            since = None if self.synced_until is None else self.synced_until - CLOCK_SLACK
+            try:
+                tokens = await asyncio.to_thread(find_tokens, since)
+            except Exception as e:
+                print(f"Error refreshing the token index: {e}")
+            else:
+                self.apply(tokens)
+                self.synced_until = started
+            self.refreshed_at = time.monotonic()
+
+    def apply(self, tokens):
+        """Take token documents into the in-memory copy."""
+        blocked = set(self.blocked)
+        for token in tokens:
+            contract = token['_id']
+            verdict = token.get('verdict', UNKNOWN)
+            self.tokens[contract] = TokenReputation(verdict, tuple(token.get('symbols', ())),
+                                                    token.get('wallets', 0), token.get('first_seen'))
+            if verdict in BLOCKED_VERDICTS:
+                blocked.add(contract)
+            else:
+                blocked.discard(contract)
+        self.blocked = frozenset(blocked)
+
+    def blocked_for(self, transactions):
+        """The contracts of a TransactionBatch to block: by their verdict, or forged if no scan has recorded them yet."""
+        return self.blocked_among(token_symbols(transactions))
+
+    def blocked_among(self, tokens):
+        """blocked_for over a token_symbols() summary, so a cached scan can be checked without walking its transfers."""
+        blocked = set()
+        for contract, symbols in tokens.items():
+            if contract in self.tokens:
+                if contract in self.blocked:
+                    blocked.add(contract)
+            elif judge({'_id': contract, 'symbols': symbols}) == FORGED:
+                blocked.add(contract)
+        return frozenset(blocked)
+
+    def record_in_background(self, wallet, transactions, valid_indices, invalid_indices):
+        """Record a classified scan without holding up its result."""
+        task = asyncio.create_task(self._record(wallet, transactions, valid_indices, invalid_indices))
+        self.recordings.add(task)
+        task.add_done_callback(self.recordings.discard)
+
+    async def _record(self, wallet, transactions, valid_indices, invalid_indices):
+        try:
+            self.apply(await asyncio.to_thread(record_scan, wallet, transactions, valid_indices, invalid_indices))
+        except Exception as e:
+            print(f"Error recording the tokens of {wallet}: {e}")
+
+
+def get_token_index():
+    """Return the process-wide token index."""
+    global _token_index
+    if _token_index is None:
+        _token_index = TokenIndex()
+    return _token_index
+
+
+def describe_token(contract, symbol, reputation):
+    """One line of the suspicious-token report."""
+    line = f"{symbol.replace('.', '[dot]')} ({contract})"
+    if reputation is None:
+        return line + '\n'
+    if reputation.verdict == FORGED:
+        line += " ⚠️ forged copy of a well-known token"
+    elif reputation.verdict == SPAM:
+        line += " 🚫 known spam token"
+    elif reputation.verdict == TRUSTED:
+        line += " ✅ genuine contract"
+    if reputation.wallets > 1:
+        line += f", seen in {reputation.wallets} wallets"
+    return line + '\n'
+
+
+def rebuild():
+    """Recompute the whole index from the stored history of every synced wallet."""
+    from main_utils import load_wallet_transactions, classify_indices
+
+    valid_tokens = get_settings().valid_tokens
+    started = time.monotonic()
+    reset_token_index()
+    index = TokenIndex()
+    index.apply(find_tokens())  # Only the tokens with a manual verdict are left
+    count = 0
+    for count, wallet in enumerate(iter_synced_wallets(), 1):
+        transactions = load_wallet_transactions(wallet)
+        valid_indices, invalid_indices = classify_indices(transactions, wallet, valid_tokens,
+                                                          index.blocked_for(transactions))
+        record_scan(wallet, transactions, valid_indices, invalid_indices)
+        if count % 100 == 0:
+            print(f"{count} wallets recorded ({count / (time.monotonic() - started):.1f} wallets/s)", file=sys.stderr)
+    print(f"Done: {count} wallets recorded in {time.monotonic() - started:.0f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument('--rebuild', action='store_true', help="recompute the index from every stored history")
+    action.add_argument('--verdict', nargs=2, metavar=('CONTRACT', 'VERDICT'),
+                        help=f"pin the verdict of a token contract: {', '.join(VERDICTS)}, or auto to unpin it")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        rebuild()
+        return
+    contract, verdict = args.verdict[0].lower(), args.verdict[1]
+    if verdict not in VERDICTS + ('auto',):
+        parser.error(f"unknown verdict {verdict}")
+    token = set_manual_token_verdict(contract, None if verdict == 'auto' else verdict)
+    if verdict == 'auto':
+        set_token_verdicts({contract: judge(token)})
+    print(f"{contract}: {judge(token) if verdict == 'auto' else verdict}")
+
+
+if __name__ == '__main__':
+    main()
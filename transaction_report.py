@@ -0,0 +1,59 @@
+import io
+import csv
+from datetime import datetime
+
+CSV_COLUMNS = ['direction', 'hash', 'from', 'to', 'value', 'token', 'contract', 'date', 'nonce']
+
+
+def in_out_symbol(tx, wallet_address):
+    """Arrow showing whether a transfer left or reached the wallet."""
+    in_out_symbol = ""
+    if wallet_address == tx.from_address:
+        in_out_symbol = "💳➡️"
+    if wallet_address == tx.to_address:
+        in_out_symbol = "➡️💳"
+    return in_out_symbol
+
+
+def find_spam(invalid_transactions):
+    """Return the invalid transfers that moved a non-zero amount and their tokens in order of appearance.
+
+    Tokens are told apart by contract address, since anyone can deploy a token under an existing
+    symbol; they come back as a dict of contract address -> the symbol it was first seen with.
+    """
+    spam_transactions = []
+    invalid_tokens = {}
+    for tx in invalid_transactions:
+        if tx.amount > 0:
+            spam_transactions.append(tx)
+            invalid_tokens.setdefault(tx.contract_address, tx.token_symbol)
+    return spam_transactions, invalid_tokens
+
+
+def format_date(tx):
+    return datetime.utcfromtimestamp(tx.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def format_transaction_line(tx, wallet_address, show_nonce=False):
+    """Render a transfer as one Markdown line of a result message."""
+    line = (f"{in_out_symbol(tx, wallet_address)} Hash: `{tx.hash}`, From: `{tx.from_address}`, To: `{tx.to_address}`, "
+            f"Value: `{tx.amount:.6f} {tx.token_symbol}`, "
+            f"Date: `{format_date(tx)}`")
+    return line + (f" {tx.nonce}\n" if show_nonce else "\n")
+
+
+def csv_row(tx, wallet_address):
+    """The CSV_COLUMNS values of a transfer."""
+    direction = 'out' if wallet_address == tx.from_address else 'in' if wallet_address == tx.to_address else ''
+    return [direction, tx.hash, tx.from_address, tx.to_address, f"{tx.amount:.6f}",
+            tx.token_symbol, tx.contract_address, format_date(tx), tx.nonce]
+
+
+def build_csv(transactions, wallet_address):
+    """Render transfers as a UTF-8 CSV document."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CSV_COLUMNS)
+    for tx in transactions:
+        writer.writerow(csv_row(tx, wallet_address))
+    return buffer.getvalue().encode('utf-8')
@@ -0,0 +1,110 @@
+import sys
+from array import array
+
+
+class Transfer:
+    """A single token transfer decoded from the explorer's string fields."""
+
+    __slots__ = ('hash', 'from_address', 'to_address', 'contract_address', 'token_symbol', 'token_decimal',
+                 'value', 'timestamp', 'nonce', 'block_number', 'confirmations')
+
+    def __init__(self, hash, from_address, to_address, contract_address, token_symbol, token_decimal,
+                 value, timestamp, nonce, block_number, confirmations):
+        self.hash = hash
+        self.from_address = from_address
+        self.to_address = to_address
+        self.contract_address = contract_address
+        self.token_symbol = token_symbol
+        self.token_decimal = token_decimal
+        self.value = value  # Raw integer amount in the token's smallest unit
+        self.timestamp = timestamp
+        self.nonce = nonce
+        self.block_number = block_number
+        self.confirmations = confirmations
+
+    @property
+    def amount(self):
+        """Value converted to a human-readable token amount."""
+        return self.value / (10 ** self.token_decimal)
+
+
+class TransactionBatch:
+    """Columnar, parsed-once storage for a wallet's token transfers.
+
+    Numbers live in typed arrays, raw values stay exact Python ints and addresses and token
+    symbols are interned, so a row costs a couple of hundred bytes instead of a dict of strings.
+    """
+
+    __slots__ = ('hashes', 'from_addresses', 'to_addresses', 'contract_addresses', 'token_symbols',
+                 'token_decimals', 'values', 'timestamps', 'nonces', 'block_numbers', 'confirmations')
+
+    def __init__(self):
+        self.hashes = []
+        self.from_addresses = []
+        self.to_addresses = []
+        self.contract_addresses = []
+        self.token_symbols = []
+        self.token_decimals = array('q')
+        self.values = []
+        self.timestamps = array('q')
+        self.nonces = array('q')
+        self.block_numbers = array('q')
+        self.confirmations = array('q')
+
+    @classmethod
+    def from_api(cls, rows):
+        """Build a batch from explorer `tokentx` result rows (any iterable of dicts)."""
+        batch = cls()
+        batch.extend(rows)
+        return batch
+
+    def extend(self, rows):
+        """Append explorer `tokentx` result rows to the batch."""
+        intern = sys.intern
+        for row in rows:
+            self.hashes.append(row['hash'])
+            self.from_addresses.append(intern(row['from']))
+            self.to_addresses.append(intern(row['to']))
+            self.contract_addresses.append(intern(row.get('contractAddress', '')))
+            self.token_symbols.append(intern(row['tokenSymbol']))
+            self.token_decimals.append(int(row['tokenDecimal']))
+            self.values.append(int(row['value']))
+            self.timestamps.append(int(row['timeStamp']))
+            self.nonces.append(int(row['nonce']))
+            self.block_numbers.append(int(row['blockNumber']))
+            self.confirmations.append(int(row['confirmations']))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __getitem__(self, i):
+        return Transfer(self.hashes[i], self.from_addresses[i], self.to_addresses[i], self.contract_addresses[i],
+                        self.token_symbols[i], self.token_decimals[i], self.values[i], self.timestamps[i],
+                        self.nonces[i], self.block_numbers[i], self.confirmations[i])
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def take(self, indices):
+        """Return a view over the rows at the given positions."""
+        return TransactionView(self, indices)
+
+
+class TransactionView:
+    """An ordered selection of rows from a TransactionBatch, sharing its columns."""
+
+    __slots__ = ('batch', 'indices')
+
+    def __init__(self, batch, indices):
+        self.batch = batch
+        self.indices = indices if isinstance(indices, array) else array('q', indices)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, i):
+        return self.batch[self.indices[i]]
+
+    def __iter__(self):
+        batch = self.batch
+        return (batch[i] for i in self.indices)
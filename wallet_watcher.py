@@ -0,0 +1,141 @@
+import time
+import random
+import asyncio
+from mongo import (iter_user_wallets, enrol_watched_wallets, find_due_wallets, update_watch_state,
+                   postpone_watch_check, find_alert_users)
+from main_utils import sync_wallet_transactions, classify_wallet, keep_background_result
+from request_scheduler import LOW, TokenBucket
+from telegram_output import get_outbox
+from settings import get_settings
+from metrics import WATCH_CHECKS, WATCH_ALERTS
+
+FIRST_INTERVAL = 15 * 60  # Seconds between checks of a wallet that was just registered
+MIN_INTERVAL = 2 * 60
+MAX_INTERVAL = 6 * 60 * 60
+SPEED_UP = 0.5  # Interval factor after a check that found new transfers
+SLOW_DOWN = 1.5  # Interval factor after a check that found nothing new
+JITTER = 0.1  # Random share added to or taken off every interval, so checks don't bunch up
+RETRY_INTERVAL = 2 * 60  # Seconds before a check that failed is tried again
+WARM_SLACK = 60  # Seconds a background result outlives the wallet's next check, to cover a slow queue
+DUE_BATCH = 50  # Watch states read per query
+CONCURRENT_CHECKS = 2
+ENROL_INTERVAL = 5 * 60  # Seconds between passes over the users collection for new and removed wallets
+IDLE_SLEEP = 10  # Seconds to wait when no wallet is due
+
+_watcher = None
+
+
+class WalletWatcher:
+    """Keeps every registered wallet synced and classified in the background and alerts users to new spam.
+
+    Each check syncs the wallet on the scheduler's low lane and classifies it only when new blocks came
+    in. Results go to a cache of their own that keeps them until the next check, so a user's tap finds
+    them without evicting what other users are looking at. A wallet whose checks keep finding new
+    transfers is checked more often, a quiet one less often, and checks start no faster than `rate`
+    per second, a share of the explorer budget. Only transfers that arrive after the first successful
+    check of a wallet raise alerts; a failed check records nothing and is retried.
+    """
+
+    def __init__(self, rate, concurrency=CONCURRENT_CHECKS):
+        self.budget = TokenBucket(rate, max(rate, 1))
+        self.slots = asyncio.Semaphore(concurrency)
+        self.checking = set()  # Wallets being checked right now
+        self.checks = set()
+        self.enrolled_at = float('-inf')
+        self.task = None
+
+    def start(self, bot):
+        """Start the background task that checks due wallets."""
+        self.task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        """Stop checking, abandoning the checks in progress."""
+        tasks = list(self.checks) + ([self.task] if self.task is not None else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.task = None
+
+    async def _run(self, bot):
+        while True:
+            try:
+                if time.monotonic() - self.enrolled_at > ENROL_INTERVAL:
+                    await asyncio.to_thread(lambda: enrol_watched_wallets(iter_user_wallets(), FIRST_INTERVAL))
+                    self.enrolled_at = time.monotonic()
+                due = await asyncio.to_thread(find_due_wallets, time.time(), DUE_BATCH, self.checking)
+            except Exception as e:
+                print(f"Error reading the watched wallets: {e}")
+                due = []
+            if not due:
+                await asyncio.sleep(IDLE_SLEEP)
+                continue
+
+            for state in due:
+                while not self.budget.try_take():
+                    await asyncio.sleep(self.budget.wait_time())
+                await self.slots.acquire()
+                self.checking.add(state['wallet'])
+                task = asyncio.create_task(self._check(bot, state))
+                self.checks.add(task)
+                task.add_done_callback(self.checks.discard)
+
+    async def _check(self, bot, state):
+        wallet = state['wallet']
+        interval = state.get('interval', FIRST_INTERVAL)
+        checked_block = state.get('checked_block')  # Highest block ingested by the last check, None before the first
+        try:
+            try:
+                last_block = await sync_wallet_transactions(wallet, LOW)
+                changed = checked_block is not None and last_block != checked_block
+                interval = max(MIN_INTERVAL, interval * SPEED_UP) if changed else min(MAX_INTERVAL, interval * SLOW_DOWN)
+                delay = interval * random.uniform(1 - JITTER, 1 + JITTER)
+                next_check = time.time() + delay
+                warm_for = delay + WARM_SLACK
+                # Nothing new since the last check: keep its result warm without classifying again, unless
+                # it was evicted or a token verdict changed, then classify anew so quiet wallets stay warm
+                if checked_block != last_block or not keep_background_result(wallet, last_block, warm_for):
+                    result = await classify_wallet(wallet, last_block, background_ttl=warm_for)
+                    if changed:
+                        block_numbers = result.invalid.batch.block_numbers
+                        new_invalid = [i for i in result.invalid.indices if block_numbers[i] > checked_block]
+                        if new_invalid:
+                            await self._alert(bot, wallet, result.invalid.batch, new_invalid)
+            except Exception as e:
+                print(f"Background check of {wallet} failed: {e}")
+                WATCH_CHECKS.inc(result='failed')
+                await asyncio.to_thread(postpone_watch_check, wallet, time.time() + RETRY_INTERVAL)
+            else:
+                WATCH_CHECKS.inc(result='changed' if changed else 'unchanged')
+                await asyncio.to_thread(update_watch_state, wallet, last_block, interval, next_check)
+        except Exception as e:
+            print(f"Error saving the watch state of {wallet}: {e}")
+        finally:
+            self.checking.discard(wallet)
+            self.slots.release()
+
+    async def _alert(self, bot, wallet, batch, new_invalid):
+        """Tell the wallet's users how many new invalid transfers arrived; the details stay in the safety check."""
+        values = batch.values
+        spam = sum(1 for i in new_invalid if values[i] > 0)
+        message = (
+            f"🔔 {len(new_invalid)} new invalid transactions reached your wallet {wallet}.\n\n"
+            f"💸 {spam} of them moved tokens (spam) and {len(new_invalid) - spam} were zero-value transfers, "
+            "a common trick to plant a look-alike address in your history.\n\n"
+            "✅ Run a Safety check from the home screen to see them. Send /alerts to switch these messages off."
+        )
+        outbox = get_outbox(bot)
+        for user_id in await asyncio.to_thread(find_alert_users, wallet):
+            try:
+                await outbox.send_message(user_id, message)
+                WATCH_ALERTS.inc()
+            except Exception as e:
+                print(f"Could not alert user {user_id}: {e}")
+
+
+def get_watcher():
+    """Return the process-wide wallet watcher, its rate split between worker processes like the scheduler's."""
+    global _watcher
+    if _watcher is None:
+        settings = get_settings()
+        _watcher = WalletWatcher(settings.api_rate_limit * settings.watch_share / settings.workers)
+    return _watcher
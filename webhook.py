@@ -0,0 +1,163 @@
+import os
+import hmac
+import json
+import time
+import signal
+import socket
+import asyncio
+from urllib.parse import urlsplit
+from telegram import Bot, Update
+from settings import get_settings
+
+MAX_BODY_SIZE = 1 << 20  # Telegram updates are far smaller; anything bigger is refused
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+RESTART_DELAY = 1  # Seconds before a crashed worker is replaced
+
+_worker_index = 0
+
+
+def worker_index():
+    """Index of this worker process, 0 when running a single process."""
+    return _worker_index
+
+
+def serve_webhook(build_application):
+    """Receive updates through a webhook, handled by `workers` forked processes sharing one socket.
+
+    Telegram only posts to HTTPS URLs, so the listener is meant to sit behind a TLS-terminating
+    reverse proxy that forwards WEBHOOK_URL to WEBHOOK_LISTEN:WEBHOOK_PORT. The kernel spreads the
+    incoming connections over the workers. Each worker builds its own application with
+    `build_application()` after the fork. Updates without the WEBHOOK_SECRET header are refused.
+    """
+    settings = get_settings()
+    if not settings.webhook_secret:
+        raise SystemExit("Webhook mode needs WEBHOOK_SECRET, otherwise anyone who can reach the listener can post updates")
+    sock = socket.create_server((settings.webhook_listen, settings.webhook_port), backlog=1024)
+    asyncio.run(_set_webhook(settings))
+
+    workers = {}  # pid -> worker index
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in workers:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for index in range(settings.workers):
+        workers[_fork_worker(build_application, sock, index)] = index
+
+    while workers:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        index = workers.pop(pid, None)
+        if index is not None and not stopping:
+            print(f"Worker {index} exited with status {status}, restarting it")
+            time.sleep(RESTART_DELAY)
+            workers[_fork_worker(build_application, sock, index)] = index
+    sock.close()
+
+
+async def _set_webhook(settings):
+    async with Bot(settings.telegram_token) as bot:
+        await bot.set_webhook(settings.webhook_url, secret_token=settings.webhook_secret,
+                              allowed_updates=Update.ALL_TYPES, max_connections=100)
+
+
+def _fork_worker(build_application, sock, index):
+    pid = os.fork()
+    if pid:
+        return pid
+
+    global _worker_index
+    _worker_index = index
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C reaches the whole group; let the parent stop us
+    status = 0
+    try:
+        asyncio.run(_run_worker(build_application(), sock))
+    except Exception as e:
+        print(f"Worker {index} failed: {e}")
+        status = 1
+    os._exit(status)
+
+
+async def _run_worker(application, sock):
+    """Run one application on the shared socket until SIGTERM."""
+    settings = get_settings()
+    path = urlsplit(settings.webhook_url).path or '/'
+
+    stopped = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopped.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle(application, path, settings.webhook_secret, reader, writer), sock=sock)
+    try:
+        await stopped.wait()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def _handle(application, path, secret, reader, writer):
+    """Serve webhook POSTs on one keep-alive connection and queue the updates they carry."""
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1')
+                if line in ('\r\n', '\n', ''):
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_SIZE:
+                _respond(writer, '413 Payload Too Large', close=True)
+                break
+            body = await reader.readexactly(length)
+
+            if method != 'POST' or urlsplit(target).path != path:
+                _respond(writer, '404 Not Found')
+            elif not hmac.compare_digest(headers.get(SECRET_HEADER, '').encode(), secret.encode()):
+                _respond(writer, '403 Forbidden')
+            else:
+                try:
+                    update = Update.de_json(json.loads(body), application.bot)
+                except (ValueError, TypeError, KeyError):
+                    _respond(writer, '400 Bad Request')
+                else:
+                    await application.update_queue.put(update)
+                    _respond(writer, '200 OK')
+            await writer.drain()
+            if headers.get('connection', '').lower() == 'close':
+                break
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+def _respond(writer, status, close=False):
+    connection = 'close' if close else 'keep-alive'
+    writer.write(f"HTTP/1.1 {status}\r\nContent-Length: 0\r\nConnection: {connection}\r\n\r\n".encode())